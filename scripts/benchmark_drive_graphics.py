@@ -0,0 +1,63 @@
+import discord_logging
+import os
+import sys
+import time
+
+log = discord_logging.init_logging(debug=False)
+
+import static
+import archive
+import file_utils
+import drive_graphic
+
+
+def archivedDrives(folder, limit):
+	drives = []
+	gameFiles = [entry.thread for entry in archive.findGames(folder=folder)] + \
+		[gameFile for gameFile in os.listdir(folder) if gameFile not in (archive.PACK_FILE, archive.INDEX_FILE)]
+	for gameFile in gameFiles:
+		game = file_utils.loadArchivedGame(gameFile, folder)
+		if game is None:
+			continue
+		for drive in game.status.plays[:-1]:
+			if len(drive):
+				drives.append(drive)
+				if len(drives) >= limit:
+					return drives
+	return drives
+
+
+if __name__ == "__main__":
+	folder = sys.argv[1] if len(sys.argv) > 1 else static.ARCHIVE_FOLDER_NAME
+	limit = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+	drives = archivedDrives(folder, limit)
+	if not len(drives):
+		log.warning(f"No drives found in {folder}")
+		sys.exit(1)
+	log.info(f"Rendering {len(drives)} drives from {folder}")
+
+	startTime = time.perf_counter()
+	uncachedFields = [drive_graphic.makeField(plays=drive, cached=False) for drive in drives]
+	uncachedSeconds = time.perf_counter() - startTime
+
+	startTime = time.perf_counter()
+	cachedFields = [drive_graphic.makeField(plays=drive) for drive in drives]
+	cachedSeconds = time.perf_counter() - startTime
+
+	mismatches = 0
+	for uncachedField, cachedField in zip(uncachedFields, cachedFields):
+		if uncachedField.tobytes() != cachedField.tobytes():
+			mismatches += 1
+
+	log.info(f"Full redraw: {uncachedSeconds:.3f}s, {uncachedSeconds / len(drives) * 1000:.3f}ms per drive")
+	log.info(f"Cached base: {cachedSeconds:.3f}s, {cachedSeconds / len(drives) * 1000:.3f}ms per drive")
+	log.info(f"Speedup: {uncachedSeconds / cachedSeconds:.1f}x, mismatches: {mismatches}")
+
+	for imageFormat in ["rgb", "palette", "svg"]:
+		startTime = time.perf_counter()
+		images = [drive_graphic.encodeField(plays=drive, image_format=imageFormat) for drive in drives]
+		encodeSeconds = time.perf_counter() - startTime
+		totalBytes = sum(len(image) for image in images)
+		log.info(
+			f"{imageFormat}: {encodeSeconds / len(drives) * 1000:.3f}ms per drive, "
+			f"{totalBytes / len(drives):.0f} bytes per drive, {totalBytes / 1024 / 1024:.2f}mb total")
@@ -0,0 +1,52 @@
+import discord_logging
+import time
+
+log = discord_logging.init_logging(debug=False)
+
+import wiki
+import state
+from classes import Play
+
+
+def matchups():
+	for playType, playDict in wiki.plays.items():
+		if playType in [Play.RUN, Play.PASS]:
+			for offense, offenseDict in playDict.items():
+				for defense, locationDict in offenseDict.items():
+					yield (playType, offense, defense), locationDict, wiki.playTables[playType][offense][defense]
+		else:
+			yield (playType,), playDict, wiki.playTables[playType]
+
+
+if __name__ == "__main__":
+	wiki.loadPlays()
+	lookups = []
+	for key, locationDict, locationTable in matchups():
+		for locationStart, locationEnd, numberTable in locationTable.items():
+			location = (locationStart + locationEnd) // 2
+			for number in range(0, 751):
+				lookups.append((key, locationDict, locationTable, location, number))
+	log.info(f"Comparing {len(lookups)} lookups")
+
+	startTime = time.perf_counter()
+	dictResults = []
+	for key, locationDict, locationTable, location, number in lookups:
+		dictResults.append(state.findNumberInRangeDict(number, state.findNumberInRangeDict(location, locationDict)))
+	dictSeconds = time.perf_counter() - startTime
+
+	startTime = time.perf_counter()
+	tableResults = []
+	for key, locationDict, locationTable, location, number in lookups:
+		tableResults.append(locationTable.find(location).find(number))
+	tableSeconds = time.perf_counter() - startTime
+
+	mismatches = 0
+	for lookup, dictResult, tableResult in zip(lookups, dictResults, tableResults):
+		if dictResult is not tableResult:
+			mismatches += 1
+			if mismatches <= 10:
+				log.warning(f"Mismatch: {lookup[0]} : {lookup[3]} : {lookup[4]} : {dictResult} : {tableResult}")
+
+	log.info(f"Dict walk: {dictSeconds:.3f}s, {dictSeconds / len(lookups) * 1000000:.2f}us per lookup")
+	log.info(f"Range tables: {tableSeconds:.3f}s, {tableSeconds / len(lookups) * 1000000:.2f}us per lookup")
+	log.info(f"Speedup: {dictSeconds / tableSeconds:.1f}x, mismatches: {mismatches}")
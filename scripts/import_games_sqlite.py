@@ -0,0 +1,43 @@
+import discord_logging
+import os
+import sys
+
+log = discord_logging.init_logging(debug=True)
+
+import static
+import archive
+import file_utils
+import game_db
+
+
+def importGame(game, archived):
+	game_db.saveGame(game, archived)
+	file_utils.journals.pop(game.thread, None)
+
+
+if __name__ == "__main__":
+	database = sys.argv[1] if len(sys.argv) > 1 else static.GAME_DATABASE_NAME
+	game_db.init(database)
+
+	count_active = 0
+	for gameFile in os.listdir(static.SAVE_FOLDER_NAME):
+		game = file_utils.loadGameObject(filename=os.path.join(static.SAVE_FOLDER_NAME, gameFile))
+		if game is None:
+			log.warning(f"Couldn't load game {gameFile}")
+			continue
+		importGame(game, False)
+		count_active += 1
+
+	count_archived = 0
+	archivedThreads = [entry.thread for entry in archive.findGames()] + \
+		[gameFile for gameFile in os.listdir(static.ARCHIVE_FOLDER_NAME) if gameFile not in (archive.PACK_FILE, archive.INDEX_FILE)]
+	for thread in archivedThreads:
+		game = file_utils.loadArchivedGame(thread)
+		if game is None:
+			log.warning(f"Couldn't load archived game {thread}")
+			continue
+		importGame(game, True)
+		count_archived += 1
+
+	game_db.close()
+	log.info(f"Imported {count_active} active and {count_archived} archived games into {database}")
@@ -3,13 +3,23 @@ import os
 
 log = discord_logging.init_logging(debug=True)
 
+import archive
 import file_utils
 
 
 if __name__ == "__main__":
 	count_games = 0
 	folder = r"C:\Users\greg\Desktop\PyCharm\CFBRef\gamesOld"
+	for header in file_utils.loadArchivedHeaders(folder=folder):
+		count_games += 1
+		if header is not None:
+			deadline = header['deadline'][:10] if header['deadline'] is not None else "no deadline"
+			log.info(f"{deadline} : {header['home']['name']} vs {header['away']['name']} : {header['playGist']}")
+
+	# Games archived before the pack file, run pack_archive.py to move them in
 	for gameFile in os.listdir(folder):
+		if gameFile in (archive.PACK_FILE, archive.INDEX_FILE):
+			continue
 		game = file_utils.loadGameObject(filename=f"{folder}\\{gameFile}")
 		count_games += 1
 		if game is not None:
@@ -0,0 +1,28 @@
+import discord_logging
+import os
+import sys
+
+log = discord_logging.init_logging(debug=True)
+
+import static
+import archive
+import file_utils
+
+
+if __name__ == "__main__":
+	folder = sys.argv[1] if len(sys.argv) > 1 else static.ARCHIVE_FOLDER_NAME
+	count_packed = 0
+	for gameFile in os.listdir(folder):
+		filename = os.path.join(folder, gameFile)
+		if gameFile in (archive.PACK_FILE, archive.INDEX_FILE) or not os.path.isfile(filename):
+			continue
+		try:
+			with open(filename, 'rb') as file:
+				data = file.read()
+			file_utils.archiveGameData(gameFile, data, folder)
+		except Exception as err:
+			log.warning(f"Couldn't pack {gameFile}: {err}")
+			continue
+		os.remove(filename)
+		count_packed += 1
+	log.info(f"Packed {count_packed} games into {os.path.join(folder, archive.PACK_FILE)}")
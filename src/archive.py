@@ -0,0 +1,110 @@
+import logging.handlers
+import mmap
+import os
+import struct
+import threading
+from datetime import datetime
+
+import static
+
+log = logging.getLogger("bot")
+
+# Archived games are appended to one data file. The index file is a list of fixed size records pointing into it,
+# so finding or listing games is a scan over the mapped index instead of loading every game
+PACK_FILE = "archive.pack"
+INDEX_FILE = "archive.index"
+INDEX_RECORD = struct.Struct("<16s32s32sqQI")
+
+archiveLock = threading.Lock()
+
+
+class ArchiveEntry:
+	def __init__(self, thread, homeTag, awayTag, deadline, offset, length):
+		self.thread = thread
+		self.homeTag = homeTag
+		self.awayTag = awayTag
+		self.deadline = deadline
+		self.offset = offset
+		self.length = length
+
+
+def packString(value, size):
+	return (value or "").encode('utf-8')[:size]
+
+
+def unpackString(value):
+	return value.rstrip(b"\0").decode('utf-8', errors='replace')
+
+
+def addGame(thread, data, homeTag, awayTag, deadline, folder=static.ARCHIVE_FOLDER_NAME):
+	with archiveLock:
+		with open(os.path.join(folder, PACK_FILE), 'ab') as packFile:
+			offset = packFile.seek(0, os.SEEK_END)
+			packFile.write(data)
+			packFile.flush()
+			os.fsync(packFile.fileno())
+		# The data is written before the index record, so a crash in between only leaves unreferenced bytes
+		with open(os.path.join(folder, INDEX_FILE), 'ab') as indexFile:
+			size = indexFile.seek(0, os.SEEK_END)
+			if size % INDEX_RECORD.size:
+				# A crash part way through the last record, drop it so this one lines up with the others
+				log.warning(f"Truncating partial record at the end of the archive index: {size % INDEX_RECORD.size} bytes")
+				indexFile.truncate(size - size % INDEX_RECORD.size)
+			indexFile.write(INDEX_RECORD.pack(
+				packString(thread, 16),
+				packString(homeTag, 32),
+				packString(awayTag, 32),
+				int(deadline.timestamp()) if deadline is not None else 0,
+				offset,
+				len(data)))
+			indexFile.flush()
+			os.fsync(indexFile.fileno())
+
+
+def readEntries(folder=static.ARCHIVE_FOLDER_NAME):
+	try:
+		indexFile = open(os.path.join(folder, INDEX_FILE), 'rb')
+	except FileNotFoundError:
+		return []
+	entries = {}
+	with indexFile:
+		size = os.fstat(indexFile.fileno()).st_size
+		size -= size % INDEX_RECORD.size
+		if size == 0:
+			return []
+		with mmap.mmap(indexFile.fileno(), 0, access=mmap.ACCESS_READ) as indexMap:
+			for offset in range(0, size, INDEX_RECORD.size):
+				thread, homeTag, awayTag, deadline, dataOffset, length = INDEX_RECORD.unpack_from(indexMap, offset)
+				thread = unpackString(thread)
+				# Archiving the same game again replaces the earlier copy
+				entries[thread] = ArchiveEntry(
+					thread, unpackString(homeTag), unpackString(awayTag),
+					datetime.utcfromtimestamp(deadline) if deadline else None, dataOffset, length)
+	return list(entries.values())
+
+
+def findGames(thread=None, tag=None, since=None, until=None, folder=static.ARCHIVE_FOLDER_NAME):
+	packedTag = unpackString(packString(tag, 32)) if tag is not None else None
+	results = []
+	for entry in readEntries(folder):
+		if thread is not None and entry.thread != thread:
+			continue
+		if packedTag is not None and packedTag not in (entry.homeTag, entry.awayTag):
+			continue
+		if since is not None and (entry.deadline is None or entry.deadline < since):
+			continue
+		if until is not None and (entry.deadline is None or entry.deadline >= until):
+			continue
+		results.append(entry)
+	return results
+
+
+# Reads the stored bytes of each entry, or just the first length bytes, from one mapping of the pack file
+def readData(entries, length=None, folder=static.ARCHIVE_FOLDER_NAME):
+	if not len(entries):
+		return []
+	with open(os.path.join(folder, PACK_FILE), 'rb') as packFile:
+		with mmap.mmap(packFile.fileno(), 0, access=mmap.ACCESS_READ) as packMap:
+			return [
+				packMap[entry.offset:entry.offset + (entry.length if length is None else min(length, entry.length))]
+				for entry in entries]
@@ -1,39 +1,68 @@
+import bisect
+import copy
 import logging
+from collections import OrderedDict
 from datetime import datetime
 from datetime import timedelta
 from enum import Enum
 
 log = logging.getLogger("bot")
 
+# Bump when the saved fields change and add a migration for the old version in migrations.py
+GAME_SCHEMA_VERSION = 1
+TEAM_SCHEMA_VERSION = 1
+
 
 class Queue:
 	def __init__(self, max_size):
-		self.list = []
-		self.hashset = set()
+		self.items = OrderedDict()
 		self.max_size = max_size
 
 	def put(self, item):
-		# log.debug(f"Queue list: {str(self.list)}")
-		# log.debug(f"Queue set: {str(self.hashset)}")
-		if self.contains(item):
-			location = self.list.index(item)
-			self.list.pop(location)
-
-		if len(self.list) >= self.max_size:
-			old_item = self.list.pop(0)
-			if old_item in self.hashset:
-				self.hashset.remove(old_item)
-			else:
-				log.warning(f"Couldn't remove item from set: {old_item} : {len(self.list)} : {len(self.hashset)}")
-
-		self.list.append(item)
-		self.hashset.add(item)
+		if item in self.items:
+			self.items.move_to_end(item)
+			return
+
+		if len(self.items) >= self.max_size:
+			self.items.popitem(last=False)
+
+		self.items[item] = None
 
 	def peek(self):
-		return self.list[0] if len(self.list) > 0 else None
+		return next(iter(self.items)) if len(self.items) > 0 else None
 
 	def contains(self, item):
-		return item in self.hashset
+		return item in self.items
+
+	def __len__(self):
+		return len(self.items)
+
+
+class RangeTable:
+	def __init__(self):
+		self.starts = []
+		self.ends = []
+		self.values = []
+
+	def add(self, start, end, value):
+		location = bisect.bisect_left(self.starts, start)
+		if location < len(self.starts) and self.starts[location] <= end or \
+				location > 0 and self.ends[location - 1] >= start:
+			log.warning(f"Overlapping range {start}-{end}, skipping")
+			return False
+		self.starts.insert(location, start)
+		self.ends.insert(location, end)
+		self.values.insert(location, value)
+		return True
+
+	def find(self, number):
+		location = bisect.bisect_right(self.starts, number) - 1
+		if location < 0 or number > self.ends[location]:
+			return None
+		return self.values[location]
+
+	def items(self):
+		return zip(self.starts, self.ends, self.values)
 
 
 class RunStatus(Enum):
@@ -103,6 +132,12 @@ class Play(Enum):
 	DELAY_OF_GAME = 12
 
 
+class WritePriority(Enum):
+	REPLY = 1
+	THREAD_EDIT = 2
+	WIKI = 3
+
+
 class PlayclockWarning(Enum):
 	NONE = 1
 	SIX_HOUR = 2
@@ -247,6 +282,11 @@ class TeamState:
 		self.timeouts = 3
 		self.requestedTimeout = TimeoutOption.NONE
 
+	def copy(self):
+		teamState = copy.copy(self)
+		teamState.quarters = list(self.quarters)
+		return teamState
+
 
 class TeamStats:
 	def __init__(self):
@@ -259,6 +299,9 @@ class TeamStats:
 		self.fieldGoalsAttempted = 0
 		self.posTime = 0
 
+	def copy(self):
+		return copy.copy(self)
+
 
 class Playbook:
 	def __init__(self, offense=None, defence=None):
@@ -319,6 +362,22 @@ class GameStatus:
 		self.defensiveNumber = None
 		self.defensiveSubmitter = None
 
+	def copy(self):
+		# Finished drives and the play summaries in them are never modified once added, so they're shared
+		# between copies. Only the drive in progress and the small mutable state objects are copied
+		status = copy.copy(self)
+		status.possession = self.possession.copy()
+		status.receivingNext = self.receivingNext.copy()
+		status.waitingOn = self.waitingOn.copy()
+		status.homeState = self.homeState.copy()
+		status.awayState = self.awayState.copy()
+		status.homeStats = self.homeStats.copy()
+		status.awayStats = self.awayStats.copy()
+		status.plays = self.plays[:-1] + [list(self.plays[-1])]
+		status.drives = list(self.drives)
+		status.timeoutMessages = list(self.timeoutMessages)
+		return status
+
 
 class Team:
 	def __init__(self, tag, name, offense, defense, conference=None, css_tag=None):
@@ -330,6 +389,7 @@ class Team:
 		self.record = None
 		self.conference = conference
 		self.css_tag = css_tag
+		self.schemaVersion = TEAM_SCHEMA_VERSION
 
 
 class Game:
@@ -353,6 +413,7 @@ class Game:
 		self.playGist = None
 		self.playRerun = False
 		self.gistUpdatePending = False
+		self.schemaVersion = GAME_SCHEMA_VERSION
 		if quarterLength is None:
 			self.quarterLength = 7*60
 		else:
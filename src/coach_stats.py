@@ -1,11 +1,13 @@
 import sqlite3
+import threading
 
 dbConn = None
+dbLock = threading.Lock()
 
 
 def init(database_name):
 	global dbConn
-	dbConn = sqlite3.connect(database_name)
+	dbConn = sqlite3.connect(database_name, check_same_thread=False)
 
 	c = dbConn.cursor()
 	c.execute('''
@@ -20,40 +22,43 @@ def init(database_name):
 
 
 def add_stat(username, lag_seconds):
-	c = dbConn.cursor()
-	c.execute('''
-		INSERT INTO coach_stats
-		(Username, Seconds)
-		VALUES (?, ?)
-	''', (username, lag_seconds))
+	with dbLock:
+		c = dbConn.cursor()
+		c.execute('''
+			INSERT INTO coach_stats
+			(Username, Seconds)
+			VALUES (?, ?)
+		''', (username, lag_seconds))
 
-	dbConn.commit()
+		dbConn.commit()
 
 
 def getCoaches():
-	c = dbConn.cursor()
-	results = []
-	for row in c.execute('''
-		select Username,
-			avg(Seconds),
-			max(Created),
-			count(*)
-		from coach_stats
-		group by Username
-		'''):
-		results.append({'username': row[0], 'seconds': row[1], 'latest': row[2], 'count': row[3]})
+	with dbLock:
+		c = dbConn.cursor()
+		results = []
+		for row in c.execute('''
+			select Username,
+				avg(Seconds),
+				max(Created),
+				count(*)
+			from coach_stats
+			group by Username
+			'''):
+			results.append({'username': row[0], 'seconds': row[1], 'latest': row[2], 'count': row[3]})
 
-	return results
+		return results
 
 
 def delete_old_stats():
-	c = dbConn.cursor()
-	c.execute('''
-		delete from coach_stats
-		where Created  <= date('now','-90 day')
-	''')
+	with dbLock:
+		c = dbConn.cursor()
+		c.execute('''
+			delete from coach_stats
+			where Created  <= date('now','-90 day')
+		''')
 
-	dbConn.commit()
+		dbConn.commit()
 
 
 def close():
@@ -6,6 +6,13 @@ reply_latency = prometheus_client.Summary('bot_latency_seconds', "Seconds delay
 gist_ratelimit = prometheus_client.Gauge('gist_requests_remaining', "How many requests to github we have left", ['method'])
 gist_event = prometheus_client.Counter('gist_event', "How many requests to github we have left", ['type', 'method'])
 gist_queue = prometheus_client.Gauge('gist_queue', "How many requests to github are queued")
+drive_uploads = prometheus_client.Counter('bot_drive_uploads', "Count of drive images uploaded, reused from the upload cache or failed", ['type'])
+reddit_writes = prometheus_client.Counter('bot_reddit_writes', "Count of writes sent to reddit", ['priority'])
+reddit_write_queue = prometheus_client.Gauge('bot_reddit_write_queue', "Writes queued for reddit", ['priority'])
+reddit_write_wait = prometheus_client.Summary('bot_reddit_write_wait_seconds', "Seconds a queued write waited before being sent", ['priority'])
+reddit_ratelimit = prometheus_client.Gauge('bot_reddit_ratelimit_remaining', "Requests left in the current reddit ratelimit window")
+datatable_cache = prometheus_client.Counter('bot_datatable_cache', "Count of reply datatables found in the local cache or fetched from reddit", ['type'])
+wiki_edits = prometheus_client.Counter('bot_wiki_edits', "Count of wiki page edits performed or skipped as unchanged", ['page', 'type'])
 
 
 def init(port):
@@ -0,0 +1,65 @@
+import logging.handlers
+import contextvars
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("bot")
+
+
+class GameDispatcher:
+	"""
+	Runs tasks on a worker pool, one lane per key. Tasks with the same key (the game thread) run in the order
+	they were submitted and never overlap, tasks with different keys run concurrently. afterTask, if set, is called
+	with the key after every task, in the same lane.
+	"""
+	def __init__(self, workers, afterTask=None):
+		self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="game")
+		self.afterTask = afterTask
+		self.lock = threading.Condition()
+		self.lanes = {}
+
+	def submit(self, key, func, *args):
+		with self.lock:
+			lane = self.lanes.get(key)
+			if lane is not None:
+				lane.append((func, args))
+				return
+			self.lanes[key] = deque()
+		self.pool.submit(self.runLane, key, func, args)
+
+	def runLane(self, key, func, args):
+		while True:
+			try:
+				contextvars.copy_context().run(func, *args)
+			except Exception as err:
+				log.warning(f"Error running task for {key}: {err}")
+				log.warning(traceback.format_exc())
+			if self.afterTask is not None:
+				try:
+					self.afterTask(key)
+				except Exception as err:
+					log.warning(f"Error finishing task for {key}: {err}")
+					log.warning(traceback.format_exc())
+
+			with self.lock:
+				lane = self.lanes[key]
+				if not len(lane):
+					del self.lanes[key]
+					self.lock.notify_all()
+					return
+				func, args = lane.popleft()
+
+	def pending(self):
+		with self.lock:
+			return len(self.lanes)
+
+	def wait(self):
+		with self.lock:
+			while len(self.lanes):
+				self.lock.wait()
+
+	def shutdown(self):
+		self.wait()
+		self.pool.shutdown()
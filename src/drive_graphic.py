@@ -1,14 +1,22 @@
+import hashlib
+import html
 import logging.handlers
+import queue
+import threading
+import time
 import traceback
-from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, astuple
 from io import BytesIO
-from typing import List
+from typing import List, Tuple
 
 import cloudinary
-from PIL import Image, ImageDraw
+from PIL import Image, ImageColor, ImageDraw
 from cloudinary.uploader import upload
 
 import static
+import counters
+import file_utils
 from classes import Play, Result, PlaySummary
 
 log = logging.getLogger("bot")
@@ -40,6 +48,18 @@ MAX_PLAY_COUNT = 42
 SPACING_BETWEEN_PLAY_LINES = static.field_height // MAX_PLAY_COUNT
 PLAY_LINE_THICKNESS = 212 // static.field_height  # 1 pixel thick when field height is 212 (default)
 
+# Drive images are rendered and uploaded off the message path, finished uploads are picked up by the main loop
+upload_pool = ThreadPoolExecutor(max_workers=static.DRIVE_UPLOAD_WORKERS, thread_name_prefix="drive")
+completed_uploads = queue.Queue()
+
+# Content hash to url of every drive image uploaded, loaded from the upload cache file on first use
+uploaded_images = None
+uploaded_images_lock = threading.Lock()
+
+# Pre-rendered empty fields, keyed by the background colors
+MAX_CACHED_BASE_FIELDS = 256
+base_fields = {}
+
 
 @dataclass
 class GraphicColors:
@@ -86,18 +106,123 @@ def init():
     )
 
 
-def uploadField(field, gameId, driveNum):
+def get_palette(colors: GraphicColors) -> Image:
+    # Every pixel in a drive graphic is one of the graphic colors, so they make an exact palette
+    rgb_colors = []
+    for color in astuple(colors):
+        if color is None:
+            continue
+        rgb_color = ImageColor.getrgb(color)[:3]
+        if rgb_color not in rgb_colors:
+            rgb_colors.append(rgb_color)
+    palette = Image.new(mode='P', size=(1, 1))
+    palette.putpalette([channel for rgb_color in rgb_colors for channel in rgb_color])
+    return palette
+
+
+def encodeField(plays: List[PlaySummary],
+                colors: GraphicColors = None,
+                image_format: str = None) -> bytes:
+    """
+    Render a drive graphic and encode it for upload
+
+    :param plays: List of plays to display on the field
+    :param colors: Optional, override default colors for graphic
+    :param image_format: Optional, one of "rgb", "palette" or "svg", defaults to static.DRIVE_IMAGE_FORMAT
+    :return: The encoded image
+    """
+    if not colors:
+        colors = get_default_colors()
+    if not image_format:
+        image_format = static.DRIVE_IMAGE_FORMAT
+
+    if image_format == "svg":
+        return makeFieldSvg(plays=plays, colors=colors).encode('utf-8')
+
+    field = makeField(plays=plays, colors=colors)
     imageFile = BytesIO()
-    field.save(imageFile, format='PNG')
-    image = imageFile.getvalue()
+    if image_format == "palette":
+        field = field.quantize(palette=get_palette(colors=colors), dither=0)
+        field.save(imageFile, format='PNG', optimize=True)
+    else:
+        field.save(imageFile, format='PNG')
+    return imageFile.getvalue()
+
+
+def get_uploaded_url(content_hash: str) -> str:
+    global uploaded_images
+    with uploaded_images_lock:
+        if uploaded_images is None:
+            uploaded_images = file_utils.loadUploadCache()
+        return uploaded_images.get(content_hash)
+
+
+def save_uploaded_url(content_hash: str, url: str):
+    with uploaded_images_lock:
+        uploaded_images[content_hash] = url
+        try:
+            file_utils.saveUpload(content_hash, url)
+        except Exception as err:
+            log.warning(f"Couldn't save upload to cache file: {err}")
+
+
+def uploadField(image, gameId, driveNum):
+    # Reprocessed plays and reruns render identical images, reuse the url from the first upload
+    content_hash = hashlib.sha256(image).hexdigest()
+    url = get_uploaded_url(content_hash)
+    if url:
+        log.debug(f"Drive image {gameId}/{driveNum} already uploaded: {url}")
+        counters.drive_uploads.labels(type="cached").inc()
+        return url
+
     try:
-        upload_result = upload(image, public_id=f"{gameId}/{driveNum}")
-        return upload_result['secure_url']
+        # Different images for the same drive get their own public id, so cached urls never point at an overwrite
+        upload_result = upload(image, public_id=f"{gameId}/{driveNum}_{content_hash[:16]}")
+        url = upload_result['secure_url']
     except Exception as err:
         log.warning("Couldn't upload drive image")
         log.warning(traceback.format_exc())
+        counters.drive_uploads.labels(type="failed").inc()
         return ""
 
+    counters.drive_uploads.labels(type="uploaded").inc()
+    save_uploaded_url(content_hash, url)
+    return url
+
+
+def queueDriveImage(plays: List[PlaySummary], gameId: str, driveNum: int, token: str):
+    upload_pool.submit(render_and_upload, list(plays), gameId, driveNum, token)
+
+
+def render_and_upload(plays: List[PlaySummary], gameId: str, driveNum: int, token: str):
+    try:
+        image = encodeField(plays=plays)
+    except Exception as err:
+        log.warning(f"Couldn't render drive image {gameId}/{driveNum}")
+        log.warning(traceback.format_exc())
+        return
+
+    for delay in static.DRIVE_UPLOAD_RETRY_SECONDS + [None]:
+        url = uploadField(image, gameId, str(driveNum))
+        if url:
+            completed_uploads.put((gameId, driveNum, token, url))
+            return
+        if delay is None:
+            break
+        log.info(f"Retrying drive image {gameId}/{driveNum} upload in {delay} seconds")
+        time.sleep(delay)
+
+    log.warning(f"Giving up on drive image {gameId}/{driveNum} after {len(static.DRIVE_UPLOAD_RETRY_SECONDS) + 1} tries")
+
+
+def popCompletedUploads():
+    uploads = []
+    while True:
+        try:
+            uploads.append(completed_uploads.get_nowait())
+        except queue.Empty:
+            return uploads
+
 
 def fill_in_box(draw: ImageDraw, x1: int, y1: int, x2: int, y2: int, color: str) -> ImageDraw:
     draw.rectangle([x1, y1, x2, y2], fill=color)
@@ -162,10 +287,7 @@ def play_is_to_endzone(play: PlaySummary) -> bool:
     return False
 
 
-def draw_play_line(draw: ImageDraw,
-                   play: PlaySummary,
-                   line_y_position: int,
-                   colors: GraphicColors) -> ImageDraw:
+def get_play_line_x(play: PlaySummary) -> Tuple[int, int]:
     start_yardage = int(play.location)
     play_yards = 0 if not play.yards else int(play.yards)
 
@@ -185,6 +307,14 @@ def draw_play_line(draw: ImageDraw,
     if start_x == end_x:
         end_x += 1
 
+    return start_x, end_x
+
+
+def draw_play_line(draw: ImageDraw,
+                   play: PlaySummary,
+                   line_y_position: int,
+                   colors: GraphicColors) -> ImageDraw:
+    start_x, end_x = get_play_line_x(play=play)
     play_color = colors.get_play_color(play=play)
 
     draw = draw_horizontal_line(draw=draw, x1=start_x, x2=end_x, y=line_y_position, color=play_color,
@@ -193,30 +323,53 @@ def draw_play_line(draw: ImageDraw,
     return draw
 
 
-def makeField(plays: List[PlaySummary],
-              colors: GraphicColors = None) -> Image:
+def get_displayed_plays(plays: List[PlaySummary]):
     """
-    Create a field image with the given plays
+    Get the plays that are drawn on the field, along with the y position of their line
 
-    :param plays: List of plays to display on the field
-    :param colors: Optional, override default colors for graphic
-    :return: Image of the field with the plays drawn
+    :param plays: List of plays in the drive
+    :return: Generator of (play, y position) tuples
     """
-    if not colors:
-        colors = GraphicColors(
-            home_team_color=DEFAULT_ENDZONE_COLOR,
-            away_team_color=DEFAULT_ENDZONE_COLOR,
-            field_color=DEFAULT_FIELD_COLOR,
-            field_line_color=DEFAULT_FIELD_LINE_COLOR,
-            endzone_border_color=DEFAULT_ENDZONE_BORDER_COLOR,
-            pass_color=DEFAULT_PASS_COLOR,
-            run_color=DEFAULT_RUN_COLOR,
-            kick_made_color=DEFAULT_KICK_MADE_COLOR,
-            kick_miss_color=DEFAULT_KICK_MISS_COLOR,
-            turnover_color=DEFAULT_TURNOVER_COLOR,
-            alt_color=DEFAULT_ALT_PLAY_COLOR
-        )
+    # Account for too many plays
+    if len(plays) > MAX_PLAY_COUNT:
+        # God help us if we ever have a drive with more than 42 plays
+        # Invert the play list, grab the "first" (last) 42 plays, and invert it back
+        plays = plays[::-1][:MAX_PLAY_COUNT][::-1]
+
+    # Currently only draws yardage-change plays (run, pass, field goal)
+    play_y_position = SPACING_BETWEEN_PLAY_LINES
+    for play in plays:
+        # Skip plays that are not displayable
+        if not is_displayable_play(play=play):
+            continue
+
+        yield play, play_y_position
+        play_y_position += SPACING_BETWEEN_PLAY_LINES
 
+
+def get_default_colors() -> GraphicColors:
+    return GraphicColors(
+        home_team_color=DEFAULT_ENDZONE_COLOR,
+        away_team_color=DEFAULT_ENDZONE_COLOR,
+        field_color=DEFAULT_FIELD_COLOR,
+        field_line_color=DEFAULT_FIELD_LINE_COLOR,
+        endzone_border_color=DEFAULT_ENDZONE_BORDER_COLOR,
+        pass_color=DEFAULT_PASS_COLOR,
+        run_color=DEFAULT_RUN_COLOR,
+        kick_made_color=DEFAULT_KICK_MADE_COLOR,
+        kick_miss_color=DEFAULT_KICK_MISS_COLOR,
+        turnover_color=DEFAULT_TURNOVER_COLOR,
+        alt_color=DEFAULT_ALT_PLAY_COLOR
+    )
+
+
+def make_base_field(colors: GraphicColors) -> Image:
+    """
+    Draw the empty field, endzones and yard lines, everything that doesn't depend on the plays
+
+    :param colors: Colors for the graphic
+    :return: Image of the empty field
+    """
     field = Image.new(mode='RGB', size=(static.field_width, static.field_height), color=colors.field_color)
     draw = ImageDraw.Draw(field)
 
@@ -238,32 +391,107 @@ def makeField(plays: List[PlaySummary],
         draw = draw_vertical_line(draw=draw, x=fifth_yard_line, y1=0, y2=static.field_height, color=color,
                                   thickness=FIELD_LINE_THICKNESS)
 
-    # Account for too many plays
-    if len(plays) > MAX_PLAY_COUNT:
-        # God help us if we ever have a drive with more than 42 plays
-        # Invert the play list, grab the "first" (last) 42 plays, and invert it back
-        plays = plays[::-1][:MAX_PLAY_COUNT][::-1]
+    return field
 
-    line_of_scrimmage_drawn = False
 
-    # Draw play lines for each play
-    # Currently only draws yardage-change plays (run, pass, field goal)
-    play_y_position = SPACING_BETWEEN_PLAY_LINES
-    for play in plays:
-        # Skip plays that are not displayable
-        if not is_displayable_play(play=play):
-            continue
+def get_base_field(colors: GraphicColors) -> Image:
+    # Only the background colors matter for the base field, play colors are drawn on top of the copy
+    key = (colors.home_team_color, colors.away_team_color, colors.field_color, colors.field_line_color,
+           colors.endzone_border_color)
+    base_field = base_fields.get(key)
+    if base_field is None:
+        if len(base_fields) >= MAX_CACHED_BASE_FIELDS:
+            base_fields.clear()
+        base_field = make_base_field(colors=colors)
+        base_fields[key] = base_field
+    return base_field
+
+
+def makeField(plays: List[PlaySummary],
+              colors: GraphicColors = None,
+              cached: bool = True) -> Image:
+    """
+    Create a field image with the given plays
 
+    :param plays: List of plays to display on the field
+    :param colors: Optional, override default colors for graphic
+    :param cached: Optional, start from a copy of the cached base field instead of drawing it from scratch
+    :return: Image of the field with the plays drawn
+    """
+    if not colors:
+        colors = get_default_colors()
+
+    if cached:
+        field = get_base_field(colors=colors).copy()
+    else:
+        field = make_base_field(colors=colors)
+    draw = ImageDraw.Draw(field)
+
+    # Draw play lines for each play
+    for play_index, (play, play_y_position) in enumerate(get_displayed_plays(plays=plays)):
         # Draw the line of scrimmage at the start location of the first displayable play
-        if not line_of_scrimmage_drawn:
+        if play_index == 0:
             draw = draw_line_of_scrimmage(draw=draw, play=play, colors=colors)
-            line_of_scrimmage_drawn = True
 
         # Draw the play line for a yardage-change play (including made field goal)
         draw = draw_play_line(draw=draw,
                               play=play,
                               line_y_position=play_y_position,
                               colors=colors)
-        play_y_position += SPACING_BETWEEN_PLAY_LINES
 
     return field
+
+
+def svg_rectangle(x1: int, y1: int, x2: int, y2: int, color: str) -> str:
+    # Pillow rectangles include both corners
+    return f'<rect x="{x1}" y="{y1}" width="{x2 - x1 + 1}" height="{y2 - y1 + 1}" ' \
+           f'fill="{html.escape(color)}"/>'
+
+
+def svg_line(x1: int, y1: int, x2: int, y2: int, color: str, thickness: int = 1) -> str:
+    if color is None:
+        return ""
+    return f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" stroke="{html.escape(color)}" ' \
+           f'stroke-width="{thickness}"/>'
+
+
+def makeFieldSvg(plays: List[PlaySummary],
+                 colors: GraphicColors = None) -> str:
+    """
+    Create the same field graphic as makeField, as an svg document
+
+    :param plays: List of plays to display on the field
+    :param colors: Optional, override default colors for graphic
+    :return: The svg document
+    """
+    if not colors:
+        colors = get_default_colors()
+
+    elements = [
+        svg_rectangle(x1=0, y1=0, x2=static.field_width - 1, y2=static.field_height - 1, color=colors.field_color),
+        svg_rectangle(x1=LEFT_ENDZONE_START_X, y1=0, x2=FIELD_START_X, y2=static.field_height,
+                      color=colors.home_team_color),
+        svg_rectangle(x1=FIELD_END_X, y1=0, x2=RIGHT_ENDZONE_END_X, y2=static.field_height,
+                      color=colors.away_team_color),
+    ]
+
+    for fifth_yard_line in range(FIELD_START_X, FIELD_END_X + 1, FIELD_LINE_INTERVAL_X):  # +1 to be inclusive
+        color = colors.endzone_border_color \
+            if (fifth_yard_line == FIELD_START_X or fifth_yard_line == FIELD_END_X) else colors.field_line_color
+        elements.append(svg_line(x1=fifth_yard_line, y1=0, x2=fifth_yard_line, y2=static.field_height, color=color,
+                                 thickness=FIELD_LINE_THICKNESS))
+
+    for play_index, (play, play_y_position) in enumerate(get_displayed_plays(plays=plays)):
+        if play_index == 0:
+            line_of_scrimmage_x = get_true_x_position(yard_position=play.location, is_home=play.posHome)
+            elements.append(svg_line(x1=line_of_scrimmage_x, y1=0, x2=line_of_scrimmage_x, y2=static.field_height,
+                                     color=colors.get_line_of_scrimmage_color(play=play),
+                                     thickness=FIELD_LINE_THICKNESS))
+
+        start_x, end_x = get_play_line_x(play=play)
+        elements.append(svg_line(x1=start_x, y1=play_y_position, x2=end_x, y2=play_y_position,
+                                 color=colors.get_play_color(play=play), thickness=PLAY_LINE_THICKNESS))
+
+    return f'<svg xmlns="http://www.w3.org/2000/svg" width="{static.field_width}" height="{static.field_height}" ' \
+           f'shape-rendering="crispEdges">{"".join(elements)}</svg>'
+
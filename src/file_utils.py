@@ -2,47 +2,330 @@ import logging.handlers
 import pickle
 import os
 import traceback
+import io
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 
 import static
+import classes
+import migrations
+import game_format
+import archive
+import game_db
+from game_journal import JOURNAL_MARKER, journals, GameJournal, JournalPickler, JournalUnpickler
 
 log = logging.getLogger("bot")
 
 
+def readJournal(file):
+	journal = GameJournal()
+	game = None
+	withHeader = game_format.hasHeader(file)
+	if withHeader:
+		file.seek(game_format.HEADER_SIZE)
+	while True:
+		try:
+			header = pickle.load(file)
+		except EOFError:
+			break
+		except Exception as err:
+			log.warning(f"Unreadable journal record, using last good record: {err}")
+			journal.records = None
+			break
+
+		if not isinstance(header, tuple) or len(header) not in (2, 4) or header[0] != JOURNAL_MARKER:
+			return header, None
+
+		try:
+			for pid, kind, value in header[1]:
+				journal.register(pid, kind, value)
+			if len(header) == 4:
+				for pid, play in zip(header[2], game_format.unpackPlays(header[3])):
+					journal.register(pid, "play", play)
+			game = JournalUnpickler(file, journal.objects).load()
+		except Exception as err:
+			log.warning(f"Truncated journal record, using last good record: {err}")
+			journal.records = None
+			break
+		journal.records += 1
+
+	if not withHeader and journal.records is not None:
+		# Written before game files had a header, rewrite it on the next save
+		journal.records = None
+	return game, journal
+
+
+def writeJournalRecord(file, newObjects, references, game):
+	# Plays are the bulk of a game, they're packed as rows instead of pickled objects
+	objects = []
+	playIds = []
+	plays = []
+	for pid, kind, value in newObjects:
+		if kind == "play" and game_format.isPackable(value):
+			playIds.append(pid)
+			plays.append(value)
+		else:
+			objects.append((pid, kind, value))
+	pickle.dump((JOURNAL_MARKER, objects, playIds, game_format.packPlays(plays)), file)
+	JournalPickler(file, references).dump(game)
+
+
+def listActiveGames():
+	if static.GAME_STORE == "sqlite":
+		return game_db.findGames()
+	return [gameFile for gameFile in os.listdir(static.SAVE_FOLDER_NAME) if not gameFile.endswith(".tmp")]
+
+
+def shouldSync(compacting):
+	return static.FSYNC_POLICY == "always" or (static.FSYNC_POLICY == "compact" and compacting)
+
+
+def syncDirectory(folder):
+	# Makes a rename durable, not possible on windows where directories can't be opened
+	try:
+		directory = os.open(folder, os.O_RDONLY)
+	except OSError:
+		return
+	try:
+		os.fsync(directory)
+	except OSError:
+		pass
+	finally:
+		os.close(directory)
+
+
+def writeAtomic(filename, write, sync=True):
+	# Write to a temp file and rename it over the original, so a crash leaves either the old or the new file
+	tempFilename = filename + ".tmp"
+	try:
+		with open(tempFilename, 'wb') as file:
+			write(file)
+			if sync:
+				file.flush()
+				os.fsync(file.fileno())
+		os.replace(tempFilename, filename)
+	except Exception:
+		try:
+			os.remove(tempFilename)
+		except FileNotFoundError:
+			pass
+		raise
+	if sync:
+		syncDirectory(os.path.dirname(filename) or ".")
+
+
+def quarantineGameFile(threadID):
+	if static.GAME_STORE == "sqlite":
+		return
+	if not os.path.exists(static.BROKEN_FOLDER_NAME):
+		os.makedirs(static.BROKEN_FOLDER_NAME)
+	try:
+		os.replace("{}/{}".format(static.SAVE_FOLDER_NAME, threadID), "{}/{}".format(static.BROKEN_FOLDER_NAME, threadID))
+	except Exception as err:
+		log.warning("Can't move broken game file: {}".format(threadID))
+		log.warning(traceback.format_exc())
+
+
 def saveGameObject(game):
-	file = open("{}/{}".format(static.SAVE_FOLDER_NAME, game.thread), 'wb')
-	pickle.dump(game, file)
-	file.close()
+	if static.GAME_STORE == "sqlite":
+		game_db.saveGame(game)
+		return
+	filename = "{}/{}".format(static.SAVE_FOLDER_NAME, game.thread)
+	journal = journals.get(game.thread)
+	if journal is None or journal.records is None or journal.records >= static.JOURNAL_COMPACT_RECORDS or \
+			not os.path.exists(filename):
+		journal = GameJournal()
+		journals[game.thread] = journal
+		mode = 'wb'
+	else:
+		mode = 'r+b'
+
+	try:
+		newObjects, references = journal.collect(game)
+		header = game_format.packHeader(game, journal.records + 1)
+		if mode == 'wb':
+			def write(file):
+				file.write(header)
+				writeJournalRecord(file, newObjects, references, game)
+			writeAtomic(filename, write, shouldSync(True))
+		else:
+			# A torn append only loses the new record, readJournal falls back to the last complete one
+			with open(filename, mode) as file:
+				file.seek(0, os.SEEK_END)
+				writeJournalRecord(file, newObjects, references, game)
+				file.seek(0)
+				file.write(header)
+				if shouldSync(False):
+					file.flush()
+					os.fsync(file.fileno())
+	except Exception:
+		del journals[game.thread]
+		raise
+	journal.records += 1
 
 
 def loadGameObject(threadID=None, filename=None):
+	fromSaveFolder = filename is None
 	if filename is None:
 		if threadID is None:
 			log.warning(f"No thread id or filename when loading game")
 			return None
+		if static.GAME_STORE == "sqlite":
+			game, journal = game_db.loadGame(threadID)
+			if game is None:
+				log.info("Game doesn't exist: {}".format(threadID))
+				return None
+			return finishLoadingGame(game, journal)
 		filename = "{}/{}".format(static.SAVE_FOLDER_NAME, threadID)
 	try:
 		file = open(filename, 'rb')
 	except FileNotFoundError as err:
 		log.info("Game file doesn't exist: {}".format(threadID))
 		return None
-	game = pickle.load(file)
+	game, journal = readJournal(file)
 	file.close()
+	if game is None:
+		log.warning(f"No complete records in game file: {filename}")
+		return None
+
+	return finishLoadingGame(game, journal, fromSaveFolder)
+
+
+def peekGameObject(threadID):
+	# Loads the saved copy of a game without touching its journal
+	if static.GAME_STORE == "sqlite":
+		game, journal = game_db.loadGame(threadID)
+		return game
+	return loadGameObject(filename="{}/{}".format(static.SAVE_FOLDER_NAME, threadID))
 
-	if not hasattr(game.status, "timeoutMessages"):
-		game.status.timeoutMessages = []
+
+def finishLoadingGame(game, journal, fromSaveFolder=True):
+	if fromSaveFolder:
+		if journal is None:
+			journals.pop(game.thread, None)
+		else:
+			journals[game.thread] = journal
+
+	if migrations.migrateGame(game) and fromSaveFolder:
+		saveGameObject(game)
 
 	return game
 
 
+def readGameFile(threadID):
+	# Runs in the load worker processes, the journal is sent back with the game so appends keep working
+	filename = "{}/{}".format(static.SAVE_FOLDER_NAME, threadID)
+	try:
+		with open(filename, 'rb') as file:
+			game, journal = readJournal(file)
+	except FileNotFoundError as err:
+		return threadID, None, None
+	return threadID, game, journal
+
+
+def loadGameObjects(threadIDs):
+	if static.GAME_STORE == "sqlite":
+		return {threadID: loadGameObject(threadID) for threadID in threadIDs}
+	if static.LOAD_WORKERS > 1 and len(threadIDs) > 1:
+		with ProcessPoolExecutor(max_workers=static.LOAD_WORKERS) as pool:
+			results = list(pool.map(readGameFile, threadIDs, chunksize=8))
+	else:
+		results = [readGameFile(threadID) for threadID in threadIDs]
+
+	loaded = {}
+	for threadID, game, journal in results:
+		if game is None:
+			log.warning(f"No complete records in game file: {threadID}")
+			loaded[threadID] = None
+		else:
+			loaded[threadID] = finishLoadingGame(game, journal)
+	return loaded
+
+
+def saveSnapshot(games):
+	if static.GAME_STORE == "sqlite":
+		return
+	snapshot = {}
+	for game in games:
+		try:
+			fileStat = os.stat("{}/{}".format(static.SAVE_FOLDER_NAME, game.thread))
+		except FileNotFoundError:
+			continue
+		snapshot[game.thread] = (fileStat.st_size, fileStat.st_mtime_ns, game, journals.get(game.thread))
+
+	writeAtomic(static.SNAPSHOT_FILE, lambda file: pickle.dump(snapshot, file), shouldSync(True))
+	log.info(f"Saved snapshot of {len(snapshot)} games")
+
+
+def loadSnapshot():
+	if static.GAME_STORE == "sqlite":
+		return {}
+	try:
+		file = open(static.SNAPSHOT_FILE, 'rb')
+	except FileNotFoundError:
+		return {}
+	try:
+		with file:
+			snapshot = pickle.load(file)
+	except Exception as err:
+		log.warning(f"Couldn't read snapshot, loading game files: {err}")
+		snapshot = {}
+	# Only good for the restart right after it was written
+	os.remove(static.SNAPSHOT_FILE)
+
+	loaded = {}
+	for threadID, (size, modified, game, journal) in snapshot.items():
+		try:
+			fileStat = os.stat("{}/{}".format(static.SAVE_FOLDER_NAME, threadID))
+		except FileNotFoundError:
+			continue
+		if fileStat.st_size != size or fileStat.st_mtime_ns != modified:
+			log.info(f"Game file changed since snapshot: {threadID}")
+			continue
+		loaded[threadID] = finishLoadingGame(game, journal)
+	log.info(f"Loaded {len(loaded)} of {len(snapshot)} games from snapshot")
+	return loaded
+
+
+def gameFileBytes(game):
+	file = io.BytesIO()
+	journal = GameJournal()
+	newObjects, references = journal.collect(game)
+	file.write(game_format.packHeader(game, 1))
+	writeJournalRecord(file, newObjects, references, game)
+	return file.getvalue()
+
+
+def archiveGameData(threadID, data, folder=static.ARCHIVE_FOLDER_NAME):
+	header = game_format.readHeader(io.BytesIO(data))
+	if header is not None:
+		homeTag, awayTag = header['home']['tag'], header['away']['tag']
+		deadline = datetime.fromisoformat(header['deadline']) if header['deadline'] is not None else None
+	else:
+		# Older file without a header, or one too large to fit, load it and store it in the current format
+		game, journal = readJournal(io.BytesIO(data))
+		if game is None:
+			raise ValueError(f"No complete records in game data: {threadID}")
+		migrations.migrateGame(game)
+		data = gameFileBytes(game)
+		homeTag, awayTag, deadline = game.home.tag, game.away.tag, game.deadline
+	archive.addGame(threadID, data, homeTag, awayTag, deadline, folder)
+
+
 def archiveGameFile(threadID):
 	log.debug("Archiving game: {}".format(threadID))
+	journals.pop(threadID, None)
+	if static.GAME_STORE == "sqlite":
+		if not game_db.archiveGame(threadID):
+			log.warning("Can't archive game: {}".format(threadID))
+			return False
+		return True
 	sourcePath = "{}/{}".format(static.SAVE_FOLDER_NAME, threadID)
-	destinationPath = "{}/{}".format(static.ARCHIVE_FOLDER_NAME, threadID)
-	if os.path.exists(destinationPath):
-		log.info("Game already exists in archive, deleting")
-		os.remove(destinationPath)
 	try:
-		os.rename(sourcePath, destinationPath)
+		with open(sourcePath, 'rb') as file:
+			data = file.read()
+		archiveGameData(threadID, data)
+		os.remove(sourcePath)
 	except Exception as err:
 		log.warning("Can't archive game file: {}".format(threadID))
 		log.warning(traceback.format_exc())
@@ -50,6 +333,26 @@ def archiveGameFile(threadID):
 	return True
 
 
+def loadArchivedGame(threadID, folder=static.ARCHIVE_FOLDER_NAME):
+	if static.GAME_STORE == "sqlite":
+		game, journal = game_db.loadGame(threadID, archived=True)
+		return finishLoadingGame(game, None, False) if game is not None else None
+	entries = archive.findGames(thread=threadID, folder=folder)
+	if not len(entries):
+		return loadGameObject(filename="{}/{}".format(folder, threadID))
+	game, journal = readJournal(io.BytesIO(archive.readData(entries, folder=folder)[0]))
+	if game is None:
+		log.warning(f"No complete records in archived game: {threadID}")
+		return None
+	return finishLoadingGame(game, None, False)
+
+
+def loadArchivedHeaders(tag=None, since=None, until=None, folder=static.ARCHIVE_FOLDER_NAME):
+	entries = archive.findGames(tag=tag, since=since, until=until, folder=folder)
+	datas = archive.readData(entries, game_format.HEADER_SIZE, folder)
+	return [game_format.readHeader(io.BytesIO(data)) for data in datas]
+
+
 def saveStringSuggestion(stringKey, suggestion):
 	with open(static.STRING_SUGGESTION_FILE, 'a') as fileHandle:
 		fileHandle.write(stringKey)
@@ -59,10 +362,31 @@ def saveStringSuggestion(stringKey, suggestion):
 		fileHandle.write("----------------------------------------\n")
 
 
+def loadUploadCache():
+	uploads = {}
+	try:
+		fileHandle = open(static.UPLOAD_CACHE_FILE, 'r')
+	except FileNotFoundError as err:
+		log.info("Upload cache file doesn't exist, returning empty")
+		return uploads
+	with fileHandle:
+		for line in fileHandle:
+			parts = line.split()
+			if len(parts) == 2:
+				uploads[parts[0]] = parts[1]
+	return uploads
+
+
+def saveUpload(contentHash, url):
+	with open(static.UPLOAD_CACHE_FILE, 'a') as fileHandle:
+		fileHandle.write(contentHash)
+		fileHandle.write(" ")
+		fileHandle.write(url)
+		fileHandle.write("\n")
+
+
 def saveTeams(teams):
-	file = open(static.TEAMS_FILE, 'wb')
-	pickle.dump(teams, file)
-	file.close()
+	writeAtomic(static.TEAMS_FILE, lambda file: pickle.dump(teams, file), shouldSync(True))
 
 
 def loadTeams():
@@ -73,9 +397,11 @@ def loadTeams():
 		return {}
 	teams = pickle.load(file)
 	file.close()
+	migrated = False
 	for team in teams:
-		if teams[team].conference == "":
-			teams[team].conference = None
-		if not hasattr(teams[team], "css_tag"):
-			teams[team].css_tag = None
+		if migrations.migrateTeam(teams[team]):
+			migrated = True
+	if migrated:
+		log.info(f"Migrated teams to schema version {classes.TEAM_SCHEMA_VERSION}")
+		saveTeams(teams)
 	return teams
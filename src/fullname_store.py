@@ -0,0 +1,99 @@
+import sqlite3
+import threading
+
+import static
+from classes import Queue
+
+
+class FullnameStore:
+	"""
+	A bounded set of reddit fullnames kept in a table of its own, optionally with some text and a time for each. Only
+	the most recent max_size are kept. If cached, the fullnames are also held in an in memory LRU so contains doesn't
+	touch the database, and claim can mark one as seen without saving it.
+	"""
+	def __init__(self, table, max_size, cached=True):
+		self.table = table
+		self.max_size = max_size
+		self.recent = Queue(max_size) if cached else None
+		self.dbConn = None
+		self.dbLock = threading.Lock()
+
+	def init(self, database_name):
+		self.dbConn = sqlite3.connect(database_name, check_same_thread=False)
+
+		with self.dbLock:
+			c = self.dbConn.cursor()
+			c.execute(f'''
+				CREATE TABLE IF NOT EXISTS {self.table} (
+					ID INTEGER PRIMARY KEY AUTOINCREMENT,
+					Fullname VARCHAR(20) NOT NULL UNIQUE,
+					Data TEXT,
+					Created REAL
+				)
+			''')
+			self.dbConn.commit()
+
+			if self.recent is not None:
+				for row in c.execute(f'''
+					SELECT Fullname
+					FROM {self.table}
+					ORDER BY ID DESC
+					LIMIT ?
+					''', (self.max_size,)).fetchall()[::-1]:
+					self.recent.put(row[0])
+
+	def contains(self, fullname):
+		with self.dbLock:
+			if self.recent is not None:
+				return self.recent.contains(fullname)
+		return self.get(fullname) is not None
+
+	def claim(self, fullname):
+		with self.dbLock:
+			self.recent.put(fullname)
+
+	def add(self, fullname, data=None, created=None):
+		with self.dbLock:
+			if self.recent is not None:
+				self.recent.put(fullname)
+			if self.dbConn is None:
+				return
+			c = self.dbConn.cursor()
+			c.execute(f'''
+				INSERT OR REPLACE INTO {self.table}
+				(Fullname, Data, Created)
+				VALUES (?, ?, ?)
+			''', (fullname, data, created))
+			c.execute(f'''
+				DELETE FROM {self.table}
+				WHERE ID <= (SELECT MAX(ID) FROM {self.table}) - ?
+			''', (self.max_size,))
+
+			self.dbConn.commit()
+
+	def get(self, fullname):
+		with self.dbLock:
+			if self.dbConn is None:
+				return None
+			c = self.dbConn.cursor()
+			c.execute(f'''
+				SELECT Data, Created
+				FROM {self.table}
+				WHERE Fullname = ?
+			''', (fullname,))
+			return c.fetchone()
+
+	def close(self):
+		with self.dbLock:
+			if self.dbConn is not None:
+				self.dbConn.commit()
+				self.dbConn.close()
+				self.dbConn = None
+
+
+# Messages and comments that were handled, or claimed while they're being handled
+processed = FullnameStore("processed", static.PROCESSED_CACHE_SIZE)
+# Comments, messages and threads the bot made, so the missed comment sweep can tell replies to the bot apart
+posted = FullnameStore("posted", static.POSTED_CACHE_SIZE)
+# The datatable embedded in each of the bot's comments and messages, with when it was sent
+datatables = FullnameStore("datatables", static.DATATABLE_CACHE_SIZE, cached=False)
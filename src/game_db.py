@@ -0,0 +1,214 @@
+import io
+import logging.handlers
+import pickle
+import sqlite3
+import threading
+
+import static
+import game_format
+from game_journal import journals, GameJournal, JournalPickler, JournalUnpickler
+from classes import PlaySummary, HomeAway
+
+log = logging.getLogger("bot")
+
+dbConn = None
+dbLock = threading.Lock()
+
+# Games are stored the same way as the file journal: play summaries as rows, the other shared objects (drives and
+# drive summaries) pickled by id, and the rest of the game pickled with references to both
+PLAY_COLUMNS = game_format.PLAY_INT_FIELDS + ["posHome"] + \
+	[field for field, enum in game_format.PLAY_ENUM_FIELDS] + game_format.PLAY_STRING_FIELDS
+
+
+def init(database_name):
+	global dbConn
+	dbConn = sqlite3.connect(database_name, check_same_thread=False)
+
+	c = dbConn.cursor()
+	c.execute('PRAGMA journal_mode=WAL')
+	c.execute('PRAGMA synchronous=NORMAL')
+	c.execute('''
+		CREATE TABLE IF NOT EXISTS games (
+			Thread VARCHAR(16) PRIMARY KEY,
+			Archived INTEGER NOT NULL DEFAULT 0,
+			HomeTag VARCHAR(80),
+			AwayTag VARCHAR(80),
+			HomeConference VARCHAR(80),
+			AwayConference VARCHAR(80),
+			Quarter INTEGER,
+			Clock INTEGER,
+			Location INTEGER,
+			Down INTEGER,
+			Yards INTEGER,
+			HomeScore INTEGER,
+			AwayScore INTEGER,
+			WaitingAction VARCHAR(20),
+			Errored INTEGER,
+			Playclock TIMESTAMP,
+			Deadline TIMESTAMP,
+			Records INTEGER NOT NULL DEFAULT 0,
+			Data BLOB NOT NULL,
+			Updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+		)
+	''')
+	# Lookups at runtime use index's in memory maps, these serve reports and tools querying the database directly
+	c.execute('CREATE INDEX IF NOT EXISTS games_home_tag ON games (HomeTag, Archived)')
+	c.execute('CREATE INDEX IF NOT EXISTS games_away_tag ON games (AwayTag, Archived)')
+	c.execute('CREATE INDEX IF NOT EXISTS games_home_conference ON games (HomeConference, Archived)')
+	c.execute('CREATE INDEX IF NOT EXISTS games_away_conference ON games (AwayConference, Archived)')
+	c.execute('CREATE INDEX IF NOT EXISTS games_playclock ON games (Archived, Playclock)')
+	c.execute(f'''
+		CREATE TABLE IF NOT EXISTS plays (
+			Thread VARCHAR(16) NOT NULL,
+			Pid INTEGER NOT NULL,
+			{', '.join(f"{column} INTEGER" for column in game_format.PLAY_INT_FIELDS + ["posHome"])},
+			{', '.join(f"{column} VARCHAR(80)" for column in PLAY_COLUMNS[len(game_format.PLAY_INT_FIELDS) + 1:])},
+			PRIMARY KEY (Thread, Pid)
+		)
+	''')
+	c.execute('''
+		CREATE TABLE IF NOT EXISTS game_objects (
+			Thread VARCHAR(16) NOT NULL,
+			Pid INTEGER NOT NULL,
+			Kind VARCHAR(10) NOT NULL,
+			Data BLOB NOT NULL,
+			PRIMARY KEY (Thread, Pid)
+		)
+	''')
+	dbConn.commit()
+
+
+def timestamp(value):
+	return value.isoformat(sep=' ') if value is not None else None
+
+
+def playRow(thread, pid, play):
+	values = [thread, pid]
+	for column in PLAY_COLUMNS:
+		value = getattr(play, column)
+		if column == "posHome":
+			value = 1 if value.isHome else 0
+		elif value is not None and column in ("play", "result", "actualResult"):
+			value = value.name
+		values.append(value)
+	return values
+
+
+def playFromRow(row):
+	play = PlaySummary.__new__(PlaySummary)
+	enums = dict(game_format.PLAY_ENUM_FIELDS)
+	for column, value in zip(PLAY_COLUMNS, row):
+		if column == "posHome":
+			value = HomeAway(value == 1)
+		elif value is not None and column in enums:
+			value = enums[column][value]
+		setattr(play, column, value)
+	return play
+
+
+def saveGame(game, archived=False):
+	journal = journals.get(game.thread)
+	compact = journal is None or journal.records is None or journal.records >= static.JOURNAL_COMPACT_RECORDS
+	if compact:
+		journal = GameJournal()
+		journals[game.thread] = journal
+
+	try:
+		newObjects, references = journal.collect(game)
+		data = io.BytesIO()
+		JournalPickler(data, references).dump(game)
+		playRows = []
+		objectRows = []
+		for pid, kind, value in newObjects:
+			if kind == "play" and game_format.isPackable(value):
+				playRows.append(playRow(game.thread, pid, value))
+			else:
+				objectRows.append((game.thread, pid, kind, pickle.dumps(value)))
+
+		with dbLock:
+			try:
+				c = dbConn.cursor()
+				if compact:
+					c.execute('DELETE FROM plays WHERE Thread = ?', (game.thread,))
+					c.execute('DELETE FROM game_objects WHERE Thread = ?', (game.thread,))
+				c.executemany(f'''
+					INSERT OR REPLACE INTO plays
+					(Thread, Pid, {', '.join(PLAY_COLUMNS)})
+					VALUES ({', '.join('?' * (len(PLAY_COLUMNS) + 2))})
+				''', playRows)
+				c.executemany('''
+					INSERT OR REPLACE INTO game_objects
+					(Thread, Pid, Kind, Data)
+					VALUES (?, ?, ?, ?)
+				''', objectRows)
+				c.execute('''
+					INSERT OR REPLACE INTO games
+					(Thread, Archived, HomeTag, AwayTag, HomeConference, AwayConference, Quarter, Clock, Location, Down,
+					Yards, HomeScore, AwayScore, WaitingAction, Errored, Playclock, Deadline, Records, Data, Updated)
+					VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+				''', (
+					game.thread, 1 if archived else 0, game.home.tag, game.away.tag, game.home.conference,
+					game.away.conference, game.status.quarter, game.status.clock, game.status.location,
+					game.status.down, game.status.yards, game.status.homeState.points, game.status.awayState.points,
+					game.status.waitingAction.name, 1 if game.errored else 0, timestamp(game.playclock),
+					timestamp(game.deadline),
+					journal.records + 1, data.getvalue()))
+				dbConn.commit()
+			except Exception:
+				dbConn.rollback()
+				raise
+	except Exception:
+		journals.pop(game.thread, None)
+		raise
+	journal.records += 1
+
+
+def loadGame(thread, archived=False):
+	with dbLock:
+		c = dbConn.cursor()
+		row = c.execute('''
+			SELECT Data, Records
+			FROM games
+			WHERE Thread = ? AND Archived = ?
+		''', (thread, 1 if archived else 0)).fetchone()
+		if row is None:
+			return None, None
+		plays = c.execute(f'''
+			SELECT Pid, {', '.join(PLAY_COLUMNS)}
+			FROM plays
+			WHERE Thread = ?
+		''', (thread,)).fetchall()
+		objects = c.execute('''
+			SELECT Pid, Kind, Data
+			FROM game_objects
+			WHERE Thread = ?
+		''', (thread,)).fetchall()
+
+	journal = GameJournal()
+	for playValues in plays:
+		journal.register(playValues[0], "play", playFromRow(playValues[1:]))
+	for pid, kind, value in objects:
+		journal.register(pid, kind, pickle.loads(value))
+	game = JournalUnpickler(io.BytesIO(row[0]), journal.objects).load()
+	journal.records = row[1]
+	return game, journal
+
+
+def archiveGame(thread):
+	with dbLock:
+		c = dbConn.cursor()
+		c.execute('UPDATE games SET Archived = 1, Updated = CURRENT_TIMESTAMP WHERE Thread = ?', (thread,))
+		dbConn.commit()
+		return c.rowcount > 0
+
+
+def findGames(archived=False):
+	with dbLock:
+		c = dbConn.cursor()
+		return [row[0] for row in c.execute('SELECT Thread FROM games WHERE Archived = ?', (1 if archived else 0,))]
+
+
+def close():
+	if dbConn is not None:
+		dbConn.commit()
+		dbConn.close()
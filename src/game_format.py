@@ -0,0 +1,149 @@
+import json
+import logging.handlers
+import struct
+
+from classes import PlaySummary, HomeAway, Play, Result
+
+log = logging.getLogger("bot")
+
+# Game files start with a fixed size header region holding the game's summary fields as json, so listing tools can
+# read them without loading the play history. The journal records follow it
+MAGIC = b"CFBG"
+FORMAT_VERSION = 1
+HEADER_SIZE = 2048
+HEADER_PREFIX = struct.Struct("<4sBH")
+
+# Play summaries are packed as fixed size rows, with their strings and enum names in a table after the rows
+PLAY_INT_FIELDS = ["homeScore", "awayScore", "quarter", "clock", "location", "down", "toGo", "offNum", "defNum",
+				   "yards", "playTime", "runoffTime"]
+PLAY_STRING_FIELDS = ["defSubmitter", "offSubmitter"]
+PLAY_ENUM_FIELDS = [("play", Play), ("result", Result), ("actualResult", Result)]
+PLAY_FIELDS = set(PLAY_INT_FIELDS + PLAY_STRING_FIELDS + [field for field, enum in PLAY_ENUM_FIELDS] + ["posHome"])
+PLAY_ROW = struct.Struct("<12iB5H")
+PLAY_COUNT = struct.Struct("<I")
+NONE_INT = -2**31
+
+
+def gameHeader(game, records):
+	status = game.status
+	return {
+		'thread': game.thread,
+		'records': records,
+		'schemaVersion': game.schemaVersion,
+		'home': {'tag': game.home.tag, 'name': game.home.name},
+		'away': {'tag': game.away.tag, 'name': game.away.name},
+		'homeScore': status.homeState.points,
+		'awayScore': status.awayState.points,
+		'quarter': status.quarter,
+		'clock': status.clock,
+		'location': status.location,
+		'down': status.down,
+		'yards': status.yards,
+		'possession': str(status.possession),
+		'waitingAction': status.waitingAction.name,
+		'waitingOn': str(status.waitingOn),
+		'winner': status.winner,
+		'errored': game.errored,
+		'playclock': game.playclock.isoformat() if game.playclock is not None else None,
+		'deadline': game.deadline.isoformat() if game.deadline is not None else None,
+		'startTime': game.startTime,
+		'playGist': game.playGist,
+	}
+
+
+def packHeader(game, records):
+	try:
+		data = json.dumps(gameHeader(game, records), default=str).encode('utf-8')
+	except Exception as err:
+		log.warning(f"Couldn't build header for game {game.thread}: {err}")
+		data = b""
+	if len(data) > HEADER_SIZE - HEADER_PREFIX.size:
+		log.info(f"Header for game {game.thread} is too large, leaving it empty")
+		data = b""
+	header = HEADER_PREFIX.pack(MAGIC, FORMAT_VERSION, len(data)) + data
+	return header + b"\0" * (HEADER_SIZE - len(header))
+
+
+def hasHeader(file):
+	prefix = file.read(HEADER_PREFIX.size)
+	file.seek(0)
+	return len(prefix) == HEADER_PREFIX.size and HEADER_PREFIX.unpack(prefix)[0] == MAGIC
+
+
+def readHeader(file):
+	data = file.read(HEADER_SIZE)
+	if len(data) < HEADER_SIZE:
+		return None
+	magic, version, length = HEADER_PREFIX.unpack_from(data)
+	if magic != MAGIC or version > FORMAT_VERSION or length == 0:
+		return None
+	try:
+		return json.loads(data[HEADER_PREFIX.size:HEADER_PREFIX.size + length].decode('utf-8'))
+	except ValueError as err:
+		log.warning(f"Unreadable game header: {err}")
+		return None
+
+
+def isPackable(play):
+	if type(play) is not PlaySummary or play.__dict__.keys() != PLAY_FIELDS or type(play.posHome) is not HomeAway:
+		return False
+	for field in PLAY_INT_FIELDS:
+		value = getattr(play, field)
+		if value is not None and (type(value) is not int or not NONE_INT < value < 2**31):
+			return False
+	for field in PLAY_STRING_FIELDS:
+		value = getattr(play, field)
+		if value is not None and type(value) is not str:
+			return False
+	for field, enum in PLAY_ENUM_FIELDS:
+		value = getattr(play, field)
+		if value is not None and type(value) is not enum:
+			return False
+	return True
+
+
+def packPlays(plays):
+	strings = []
+	stringIndexes = {}
+
+	def stringIndex(value):
+		if value is None:
+			return 0
+		index = stringIndexes.get(value)
+		if index is None:
+			strings.append(value)
+			index = len(strings)
+			stringIndexes[value] = index
+		return index
+
+	rows = [PLAY_COUNT.pack(len(plays))]
+	for play in plays:
+		rows.append(PLAY_ROW.pack(
+			*[NONE_INT if getattr(play, field) is None else getattr(play, field) for field in PLAY_INT_FIELDS],
+			1 if play.posHome.isHome else 0,
+			*[stringIndex(None if getattr(play, field) is None else getattr(play, field).name) for field, enum in PLAY_ENUM_FIELDS],
+			*[stringIndex(getattr(play, field)) for field in PLAY_STRING_FIELDS]
+		))
+	rows.append(json.dumps(strings).encode('utf-8'))
+	return b"".join(rows)
+
+
+def unpackPlays(data):
+	count = PLAY_COUNT.unpack_from(data)[0]
+	tableStart = PLAY_COUNT.size + count * PLAY_ROW.size
+	strings = [None] + json.loads(data[tableStart:].decode('utf-8'))
+	enumCount = len(PLAY_ENUM_FIELDS)
+
+	plays = []
+	for values in PLAY_ROW.iter_unpack(data[PLAY_COUNT.size:tableStart]):
+		play = PlaySummary.__new__(PlaySummary)
+		for field, value in zip(PLAY_INT_FIELDS, values):
+			setattr(play, field, None if value == NONE_INT else value)
+		play.posHome = HomeAway(values[len(PLAY_INT_FIELDS)] == 1)
+		enumValues = values[len(PLAY_INT_FIELDS) + 1:len(PLAY_INT_FIELDS) + 1 + enumCount]
+		for (field, enum), index in zip(PLAY_ENUM_FIELDS, enumValues):
+			setattr(play, field, None if index == 0 else enum[strings[index]])
+		for field, index in zip(PLAY_STRING_FIELDS, values[len(PLAY_INT_FIELDS) + 1 + enumCount:]):
+			setattr(play, field, strings[index])
+		plays.append(play)
+	return plays
@@ -0,0 +1,90 @@
+import pickle
+
+
+JOURNAL_MARKER = "journal"
+
+journals = {}
+
+
+def journalKey(kind, value):
+	if kind == "play":
+		return kind, str(value)
+	elif kind == "entry":
+		return kind, str(value['summary']), value['url']
+	else:
+		return kind, value
+
+
+class GameJournal:
+	def __init__(self):
+		self.records = 0
+		self.objects = {}
+		self.content = {}
+		self.identity = {}
+
+	# Object ids don't survive being sent between processes or written to a snapshot, rebuild them on load
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['identity']
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.identity = {}
+		for key, pid in self.content.items():
+			if key[0] != "drive":
+				value = self.objects[pid]
+				self.identity[id(value)] = (value, pid)
+
+	def register(self, pid, kind, value):
+		self.objects[pid] = value
+		self.content[journalKey(kind, value)] = pid
+		if kind != "drive":
+			self.identity[id(value)] = (value, pid)
+
+	def reference(self, kind, value, newObjects):
+		if kind != "drive":
+			known = self.identity.get(id(value))
+			if known is not None and known[0] is value:
+				return known[1]
+		pid = self.content.get(journalKey(kind, value))
+		if pid is None:
+			pid = len(self.objects)
+			self.register(pid, kind, value)
+			newObjects.append((pid, kind, value))
+		return pid
+
+	def collect(self, game):
+		newObjects = []
+		references = {}
+		for status in [game.status] + game.previousStatus:
+			for drive in status.plays:
+				playIds = tuple(self.reference("play", play, newObjects) for play in drive)
+				references[id(drive)] = (drive, ("drive", self.reference("drive", playIds, newObjects)))
+			for entry in status.drives:
+				references[id(entry)] = (entry, ("entry", self.reference("entry", entry, newObjects)))
+		return newObjects, references
+
+
+class JournalPickler(pickle.Pickler):
+	def __init__(self, file, references):
+		super().__init__(file)
+		self.references = references
+
+	def persistent_id(self, obj):
+		reference = self.references.get(id(obj))
+		if reference is None:
+			return None
+		return reference[1]
+
+
+class JournalUnpickler(pickle.Unpickler):
+	def __init__(self, file, objects):
+		super().__init__(file)
+		self.objects = objects
+
+	def persistent_load(self, pid):
+		kind, objectId = pid
+		if kind == "drive":
+			return [self.objects[playId] for playId in self.objects[objectId]]
+		return self.objects[objectId]
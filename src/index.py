@@ -1,9 +1,11 @@
-import os
+import heapq
+import itertools
+import threading
 import logging.handlers
 import traceback
+import pickle
 from datetime import datetime
 from datetime import timedelta
-import sys
 
 import discord_logging
 
@@ -13,26 +15,49 @@ import wiki
 import counters
 import messages
 import file_utils
+import string_utils
 from classes import Action, PlayclockWarning
 
 log = logging.getLogger("bot")
 
 games = {}
+teamGames = {}
+# Held when changing or iterating games and the playclock queues, since games are processed on worker threads
+gamesLock = threading.RLock()
+
+penaltyQueue = []
+warningQueue = []
+playclockSequence = itertools.count()
+scheduledPlayclocks = {}
+# Games changed since they were last written to disk, flushed when the task working on them finishes
+pendingSaves = {}
+
+
+coachChanges = []
 
 
 def init():
 	global games
 	games = {}
+	teamGames.clear()
+	penaltyQueue.clear()
+	warningQueue.clear()
+	scheduledPlayclocks.clear()
+	coachChanges.clear()
+	pendingSaves.clear()
 	count_games = 0
-	for gameFile in os.listdir(static.SAVE_FOLDER_NAME):
-		game = reloadAndReturn(gameFile, alwaysReturn=True)
+	gameFiles = file_utils.listActiveGames()
+	loaded = file_utils.loadSnapshot()
+	loaded.update(file_utils.loadGameObjects([gameFile for gameFile in gameFiles if gameFile not in loaded]))
+	for gameFile in gameFiles:
+		game = loaded.get(gameFile)
+		if game is not None:
+			game = activateGame(game, alwaysReturn=True)
 		if game is None:
-			log.warning(f"Couldn't load game file {gameFile}")
+			log.warning(f"Couldn't load game file {gameFile}, moving it to {static.BROKEN_FOLDER_NAME}")
 			discord_logging.flush_discord()
-			sys.exit(1)
-
-		if not hasattr(game, "gistUpdatePending"):
-			game.gistUpdatePending = False
+			file_utils.quarantineGameFile(gameFile)
+			continue
 
 		if game.gistUpdatePending:
 			log.info(f"Game {game.thread} has playlist update pending")
@@ -55,49 +80,129 @@ def init():
 					team.coaches = wikiTeam.coaches
 
 			if changed:
-				try:
-					if len(game.previousStatus):
-						log.debug("Reverting status and reprocessing {}".format(game.previousStatus[0].messageId))
-						utils.revertStatus(game, 0)
-						file_utils.saveGameObject(game)
-						messages.reprocessPlay(game, game.status.messageId, True)
-					else:
-						log.info("Coaches changed, but game has no plays, not reprocessing")
-
-					game = reloadAndReturn(game.thread)
-				except Exception as err:
-					log.warning(traceback.format_exc())
-					log.warning("Unable to revert game when changing coaches")
-
-			games[game.thread] = game
+				# Reprocessing talks to reddit, so it waits until the bot is running
+				coachChanges.append(game.thread)
+
+			indexGame(game)
+			schedulePlayclock(game)
+			utils.requestMissingDriveImages(game)
 
 	counters.active_games.set(count_games)
 
 
+def popCoachChanges():
+	threads = list(coachChanges)
+	coachChanges.clear()
+	return threads
+
+
+def reprocessCoachChange(thread):
+	game = games.get(thread)
+	if game is None:
+		return
+	try:
+		if len(game.previousStatus):
+			log.debug("Reverting status and reprocessing {}".format(game.previousStatus[0].messageId))
+			utils.revertStatus(game, 0)
+			saveGame(game)
+			messages.reprocessPlay(game, game.status.messageId, True)
+		else:
+			log.info("Coaches changed, but game has no plays, not reprocessing")
+			saveGame(game)
+	except Exception as err:
+		log.warning(traceback.format_exc())
+		log.warning("Unable to revert game when changing coaches")
+
+
 def getAllGames():
-	allGames = []
-	for thread in games:
-		allGames.append(games[thread])
+	with gamesLock:
+		allGames = list(games.values())
 	allGames.sort(key=utils.gameSortValue)
 	return allGames
 
 
+def getGamesSnapshot():
+	with gamesLock:
+		return dict(games)
+
+
+def indexGame(game):
+	with gamesLock:
+		games[game.thread] = game
+		teamGames[game.home.tag] = game.thread
+		teamGames[game.away.tag] = game.thread
+
+
 def addNewGame(game):
-	games[game.thread] = game
+	indexGame(game)
+	schedulePlayclock(game)
 	counters.active_games.inc()
 
 
+def getGame(thread, alwaysReturn=False):
+	game = games.get(thread)
+	if game is None:
+		# Not an active game, it might still be sitting in the save folder
+		return reloadAndReturn(thread, alwaysReturn)
+	if static.CHECK_GAME_CACHE:
+		checkGameCache(game)
+	if game.status.waitingAction != Action.END or alwaysReturn:
+		return game
+	log.info(f"Tried to load ended game")
+	return None
+
+
+def checkGameCache(game):
+	with gamesLock:
+		if game.thread in pendingSaves:
+			return
+	savedGame = file_utils.peekGameObject(game.thread)
+	if savedGame is None:
+		log.warning(f"Game {game.thread} is in memory but not on disk")
+	elif pickle.dumps(savedGame.status) != pickle.dumps(game.status) or \
+			string_utils.renderGame(savedGame) != string_utils.renderGame(game):
+		log.warning(f"Game {game.thread} in memory doesn't match the saved file")
+
+
+def saveGame(game):
+	with gamesLock:
+		pendingSaves[game.thread] = game
+
+
+def flushGames(thread=None):
+	with gamesLock:
+		if thread is None:
+			toSave = list(pendingSaves.values())
+			pendingSaves.clear()
+		elif thread in pendingSaves:
+			toSave = [pendingSaves.pop(thread)]
+		else:
+			return True
+
+	saved = True
+	for game in toSave:
+		try:
+			file_utils.saveGameObject(game)
+		except Exception as err:
+			log.warning(f"Couldn't save game {game.thread}, will try again: {err}")
+			log.warning(traceback.format_exc())
+			with gamesLock:
+				pendingSaves.setdefault(game.thread, game)
+			saved = False
+	return saved
+
+
 def reloadAndReturn(thread, alwaysReturn=False):
 	game = file_utils.loadGameObject(thread)
 	if game is None:
 		return None
-	for team in [game.home, game.away]:
-		if team.conference == "":
-			team.conference = None
-		if not hasattr(team, "css_tag"):
-			team.css_tag = None
+	return activateGame(game, alwaysReturn)
+
+
+def activateGame(game, alwaysReturn=False):
 	if game.status.waitingAction != Action.END:
-		games[game.thread] = game
+		indexGame(game)
+		schedulePlayclock(game)
 		return game
 	elif alwaysReturn:
 		log.info(f"Tried to load ended game")
@@ -107,34 +212,81 @@ def reloadAndReturn(thread, alwaysReturn=False):
 		return None
 
 
+warningHours = {
+	None: 0,
+	PlayclockWarning.TWELVE_HOUR: 12,
+	PlayclockWarning.SIX_HOUR: 6,
+}
+
+
+def schedulePlayclock(game):
+	with gamesLock:
+		if scheduledPlayclocks.get(game.thread) == game.playclock:
+			return
+		scheduledPlayclocks[game.thread] = game.playclock
+		heapq.heappush(penaltyQueue, (game.playclock, next(playclockSequence), game.thread, game.playclock, None))
+		for warning in [PlayclockWarning.TWELVE_HOUR, PlayclockWarning.SIX_HOUR]:
+			heapq.heappush(
+				warningQueue,
+				(game.playclock - timedelta(hours=warningHours[warning]), next(playclockSequence), game.thread,
+				 game.playclock, warning))
+
+
+def isPlayclockDue(game, warning=None):
+	if game is None or game.errored:
+		return False
+	if warning == PlayclockWarning.TWELVE_HOUR and game.playclockWarning != PlayclockWarning.NONE:
+		return False
+	if warning == PlayclockWarning.SIX_HOUR and game.playclockWarning == PlayclockWarning.SIX_HOUR:
+		return False
+	return game.playclock - timedelta(hours=warningHours[warning]) < datetime.utcnow()
+
+
+def popDuePlayclocks(queue):
+	due = []
+	now = datetime.utcnow()
+	with gamesLock:
+		while len(queue) and queue[0][0] < now:
+			deadline, sequence, thread, playclock, warning = heapq.heappop(queue)
+			game = games.get(thread)
+			if game is None or game.playclock != playclock or not isPlayclockDue(game, warning):
+				continue
+			due.append((warning, game))
+
+		# Retry in case handling it fails, this is skipped once the playclock or warning is updated
+		for warning, game in due:
+			heapq.heappush(
+				queue,
+				(now + timedelta(seconds=static.LOOP_TIME), next(playclockSequence), game.thread, game.playclock, warning))
+	return due
+
+
 def getGamesPastPlayclock():
-	pastPlayclock = []
-	for thread in games:
-		game = games[thread]
-		if not game.errored and game.playclock < datetime.utcnow():
-			pastPlayclock.append(game)
-	return pastPlayclock
+	return [game for warning, game in popDuePlayclocks(penaltyQueue)]
 
 
 def getGamesPastPlayclockWarning():
-	pastPlayclock = []
-	for thread in games:
-		game = games[thread]
-		if game.errored:
-			continue
-		seconds_till_playclock = (game.playclock - datetime.utcnow()).total_seconds()
-		if seconds_till_playclock < (12 * 60 * 60) and game.playclockWarning in {PlayclockWarning.NONE}:
-			pastPlayclock.append((PlayclockWarning.TWELVE_HOUR, "12", game))
-		elif seconds_till_playclock < (6 * 60 * 60) and game.playclockWarning in {PlayclockWarning.NONE, PlayclockWarning.TWELVE_HOUR}:
-			pastPlayclock.append((PlayclockWarning.SIX_HOUR, "6", game))
-	return pastPlayclock
+	# If the bot was down both warnings can come due at once, only send the closest one
+	mostSevere = {}
+	for warning, game in popDuePlayclocks(warningQueue):
+		current = mostSevere.get(game.thread)
+		if current is None or warningHours[warning] < warningHours[current[0]]:
+			mostSevere[game.thread] = (warning, game)
+	return [(warning, str(warningHours[warning]), game) for warning, game in mostSevere.values()]
 
 
 def endGame(game):
 	if game.gistUpdatePending:
 		utils.paste_plays(game, True)
-	if game.thread in games:
-		del games[game.thread]
+	with gamesLock:
+		if game.thread in games:
+			del games[game.thread]
+		for team in [game.home, game.away]:
+			if teamGames.get(team.tag) == game.thread:
+				del teamGames[team.tag]
+		scheduledPlayclocks.pop(game.thread, None)
+	utils.flushGameThread(game.thread)
+	flushGames(game.thread)
 	file_utils.archiveGameFile(game.thread)
 	counters.active_games.dec()
 	wiki.updateTeamsWiki()
@@ -150,11 +302,11 @@ def clearGameErrored(game):
 	game.errored = False
 	game.deadline = game.deadline + (datetime.utcnow() - game.playclock)
 	game.playclock = datetime.utcnow() + timedelta(hours=18)
+	schedulePlayclock(game)
 
 
 def getGameFromTeamTag(tag):
-	for thread in games:
-		game = games[thread]
-		if game.home.tag == tag or game.away.tag == tag:
-			return game
-	return None
+	thread = teamGames.get(tag)
+	if thread is None:
+		return None
+	return games.get(thread)
@@ -1,11 +1,11 @@
 import os
 import logging.handlers
 import time
+import functools
 import sys
 import signal
 import traceback
 import discord_logging
-import praw
 from datetime import datetime, timedelta
 
 import static
@@ -20,12 +20,15 @@ import string_utils
 import drive_graphic
 import counters
 import coach_stats
-from classes import Action, PlayclockWarning, Queue
+import dispatcher
+from fullname_store import processed, posted, datatables
+import game_db
+from classes import Action, PlayclockWarning
 
 
 class ContextFilter(logging.Filter):
 	def filter(self, record):
-		record.gameid = static.logGameId
+		record.gameid = static.logGameId.get()
 		return True
 
 
@@ -35,11 +38,22 @@ log = discord_logging.init_logging(
 	format_string='%(asctime)s - %(levelname)s:%(gameid)s %(message)s'
 )
 log.addFilter(ContextFilter())
+game_dispatcher = None
 
 
 def signal_handler(signal, frame):
 	log.info("Handling interupt")
+	if game_dispatcher is not None:
+		# Let lanes finish the message they're on, so nothing is saved or recorded half processed
+		game_dispatcher.shutdown()
+	index.flushGames()
+	utils.publishGameThreads(force=True)
+	save_snapshot()
 	coach_stats.close()
+	datatables.close()
+	processed.close()
+	posted.close()
+	game_db.close()
 	discord_logging.flush_discord()
 	sys.exit(0)
 
@@ -47,7 +61,17 @@ def signal_handler(signal, frame):
 signal.signal(signal.SIGINT, signal_handler)
 
 
-def handle_message(message):
+def save_snapshot():
+	if not static.SNAPSHOT_ON_SHUTDOWN:
+		return
+	try:
+		file_utils.saveSnapshot(index.getGamesSnapshot().values())
+	except Exception as err:
+		log.warning(f"Couldn't save games snapshot: {err}")
+		log.warning(traceback.format_exc())
+
+
+def handle_message(message, process, flush):
 	startTime = time.perf_counter()
 
 	log.debug(
@@ -55,10 +79,7 @@ def handle_message(message):
 		f"{(datetime.utcnow() - datetime.utcfromtimestamp(message.created_utc)).total_seconds()}")
 
 	try:
-		if isinstance(message, praw.models.Comment):
-			recently_processed_comments.put(message.id)
-
-		messages.processMessage(message)
+		process()
 		counters.objects_replied.inc()
 	except Exception as err:
 		if utils.error_is_transient(err):
@@ -68,12 +89,17 @@ def handle_message(message):
 		else:
 			log.warning(f"Error processing message: {err}")
 			log.warning(traceback.format_exc())
-		if static.game is not None:
-			log.debug("Setting game {} as errored".format(static.game.thread))
-			index.setGameErrored(static.game)
-			file_utils.saveGameObject(static.game)
-
-			message.reply(string_utils.renderErrorMessage())
+		game = static.game.get()
+		if game is not None:
+			log.debug("Setting game {} as errored".format(game.thread))
+			index.setGameErrored(game)
+			index.saveGame(game)
+
+			try:
+				message.reply(string_utils.renderErrorMessage())
+			except Exception as err2:
+				log.warning("Error replying to errored game message")
+				log.warning(traceback.format_exc())
 
 		try:
 			message.mark_read()
@@ -81,10 +107,115 @@ def handle_message(message):
 			log.warning("Error marking errored game message as read")
 			log.warning(traceback.format_exc())
 
+	# Only remember the message once the games it changed are on disk, so a crash before then processes it again
+	if flush():
+		processed.add(message.fullname)
 	log.debug("Message processed after: %d", int(time.perf_counter() - startTime))
 	utils.clearLogGameID()
 
 
+def dispatch_message(message):
+	if processed.contains(message.fullname):
+		log.info(f"Skipping already processed message: {message.fullname}")
+		try:
+			message.mark_read()
+		except Exception as err:
+			log.warning(f"Error marking processed message as read: {err}")
+		return
+	processed.claim(message.fullname)
+
+	try:
+		dataTable = messages.getMessageDataTable(message)
+	except Exception as err:
+		log.warning(f"Error getting datatable, processing message after other games: {err}")
+		game_dispatcher.wait()
+		handle_message(message, functools.partial(messages.processMessage, message), index.flushGames)
+		reprocess_coach_changes()
+		return
+
+	if dataTable is not None:
+		game_dispatcher.submit(
+			dataTable['thread'], handle_message, message,
+			functools.partial(messages.processParsedMessage, message, dataTable),
+			functools.partial(index.flushGames, dataTable['thread']))
+	else:
+		# Admin and new game messages can touch any game, so wait for everything else to finish first
+		game_dispatcher.wait()
+		handle_message(message, functools.partial(messages.processParsedMessage, message, None), index.flushGames)
+		reprocess_coach_changes()
+
+
+def reprocess_coach_changes():
+	# Coach changes are found when the games are indexed, at startup or on a reindex message
+	for thread in index.popCoachChanges():
+		game_dispatcher.submit(thread, index.reprocessCoachChange, thread)
+
+
+def handle_delay_of_game(thread):
+	game = index.games.get(thread)
+	if not index.isPlayclockDue(game):
+		return
+	state.executeDelayOfGame(game)
+	if game.status.waitingAction == Action.END:
+		index.endGame(game)
+
+
+def send_playclock_warning(thread, warning, hours):
+	game = index.games.get(thread)
+	if not index.isPlayclockDue(game, warning):
+		return
+	warningText = \
+		"This is a warning that your [game]({}) is waiting on a reply from you to " \
+		"this {}. You have {} hours until a delay of game penalty."\
+		.format(
+			string_utils.getLinkToThread(game.thread),
+			string_utils.getLinkFromGameThing(game.thread, utils.getPrimaryWaitingId(game.status.waitingId)),
+			hours)
+	try:
+		reddit.sendMessage(
+			recipients=game.team(game.status.waitingOn).coaches,
+			subject="{} vs {} {} hour warning".format(game.away.name, game.home.name, hours),
+			message=warningText,
+			findSent=False)
+	except Exception as err:
+		log.warning(f"Error sending {hours} hour warning message to {game.team(game.status.waitingOn).coaches}")
+		return
+	log.debug(
+		"{} hour warning sent to {} for game {}"
+		.format(
+			hours,
+			string_utils.getCoachString(game, game.status.waitingOn),
+			game.thread
+		)
+	)
+	game.playclockWarning = warning
+	index.saveGame(game)
+
+
+def check_playclocks():
+	for game in index.getGamesPastPlayclock():
+		game_dispatcher.submit(game.thread, handle_delay_of_game, game.thread)
+
+	for warning, hours, game in index.getGamesPastPlayclockWarning():
+		game_dispatcher.submit(game.thread, send_playclock_warning, game.thread, warning, hours)
+
+
+def check_drive_images():
+	for thread, driveNum, token, url in drive_graphic.popCompletedUploads():
+		game_dispatcher.submit(thread, utils.setDriveImage, thread, driveNum, token, url)
+
+
+def resend_gist(thread):
+	game = index.getGame(thread)
+	if game is None:
+		log.warning(f"Game for thread doesn't exist: {thread}")
+		static.GIST_PENDING.discard(thread)
+		return
+	log.info(f"Resending gist: {game.thread} : {game.playGist}")
+	utils.paste_plays(game)
+	index.saveGame(game)
+
+
 if __name__ == "__main__":
 	if not os.path.exists(static.SAVE_FOLDER_NAME):
 		os.makedirs(static.SAVE_FOLDER_NAME)
@@ -126,116 +257,119 @@ if __name__ == "__main__":
 
 	wiki.loadPages()
 
+	if static.GAME_STORE == "sqlite":
+		game_db.init(static.GAME_DATABASE_NAME)
+
 	index.init()
 
 	drive_graphic.init()
 
 	coach_stats.init("database.db")
+	datatables.init(static.DATABASE_NAME)
+	processed.init(static.DATABASE_NAME)
+	posted.init(static.DATABASE_NAME)
+	# Games started before the posted store existed are waiting on comments it doesn't know about yet
+	for game in list(index.games.values()):
+		posted.add("t3_" + game.thread)
+		for fullname in game.status.waitingId.split(","):
+			if fullname.startswith("t1_") or fullname.startswith("t4_"):
+				posted.add(fullname)
 
 	if update_wiki:
 		wiki.updateTeamsWiki()
 		wiki.updateCoachesWiki()
 		wiki.updateGamesWiki()
+		wiki.publishWikiPages(force=True)
 
+	# Games are written to disk once the task working on them is done
+	game_dispatcher = dispatcher.GameDispatcher(static.MESSAGE_WORKERS, index.flushGames)
+	reprocess_coach_changes()
 	count_messages = 0
 	comments_checked = None
-	recently_processed_comments = Queue(200)
+	newest_comment = None
+	newest_created = 0
 	while True:
 		try:
-			for message in reddit.getMessageStream():
+			for message in reddit.getMessageStream(pause_after=0):
+				if message is None:
+					check_playclocks()
+					check_drive_images()
+					utils.publishGameThreads()
+					wiki.publishWikiPages()
+					reddit.processWrites()
+					utils.clearLogGameID()
+					discord_logging.flush_discord()
+					continue
+
 				wiki.loadPages()
 				count_messages += 1
 
-				if isinstance(message, praw.models.Comment):
-					recently_processed_comments.put(message.id)
-				handle_message(message)
+				dispatch_message(message)
 
-				for game in index.getGamesPastPlayclock():
-					state.executeDelayOfGame(game)
-					if game.status.waitingAction == Action.END:
-						index.endGame(game)
-
-				try:
-					for warning, hours, game in index.getGamesPastPlayclockWarning():
-						warningText = \
-							"This is a warning that your [game]({}) is waiting on a reply from you to " \
-							"this {}. You have {} hours until a delay of game penalty."\
-							.format(
-								string_utils.getLinkToThread(game.thread),
-								string_utils.getLinkFromGameThing(game.thread, utils.getPrimaryWaitingId(game.status.waitingId)),
-								hours)
-						try:
-							results = reddit.sendMessage(
-								recipients=game.team(game.status.waitingOn).coaches,
-								subject="{} vs {} {} hour warning".format(game.away.name, game.home.name, hours),
-								message=warningText)
-						except Exception as err:
-							log.warning(f"Error sending {hours} hour warning message to {game.team(game.status.waitingOn).coaches}")
-						log.debug(
-							"{} hour warning sent to {} for game {}: {}"
-							.format(
-								hours,
-								string_utils.getCoachString(game, game.status.waitingOn),
-								game.thread,
-								','.join([result.fullname for result in results])
-							)
-						)
-						game.playclockWarning = warning
-						file_utils.saveGameObject(game)
-				except Exception as e:
-					log.warning(f"Exception sending warning messages: {e}")
+				check_playclocks()
+				check_drive_images()
 
 				counters.gist_queue.set(len(static.GIST_PENDING))
 				if (not static.GIST_LIMITED or datetime.utcnow() > static.GIST_RESET) and len(static.GIST_PENDING):
 					log.info(f"Resending gists: {static.GIST_LIMITED} : {static.GIST_RESET} : {len(static.GIST_PENDING)}")
 					for thread in list(static.GIST_PENDING):
-						game = index.reloadAndReturn(thread)
-						if game is None:
-							log.warning(f"Game for thread doesn't exist: {thread}")
-							static.GIST_PENDING.remove(thread)
-							continue
-						log.info(f"Resending gist: {game.thread} : {game.playGist}")
-						if game is not None:
-							utils.paste_plays(game)
-							file_utils.saveGameObject(game)
+						game_dispatcher.submit(thread, resend_gist, thread)
 
 				utils.clearLogGameID()
 
 				if comments_checked is None:
-					for comment in reddit.getSubredditComments(static.SUBREDDIT):
-						if comment.author.name.lower() == "nfcaaofficialrefbot":
-							continue
-						recently_processed_comments.put(comment.id)
+					# Only sweep comments made after startup, the newest one we've looked at is where the next sweep resumes
+					for comment in reddit.getSubredditComments(static.SUBREDDIT, limit=1):
+						newest_comment = comment.fullname
+						newest_created = comment.created_utc
 
 					comments_checked = datetime.utcnow()
 
 				try:
 					if comments_checked < datetime.utcnow() - timedelta(minutes=2):
-						for comment in reddit.getSubredditComments(static.SUBREDDIT):
-							if recently_processed_comments.contains(comment.id):
-								continue
+						comments = list(reddit.getSubredditComments(static.SUBREDDIT, before=newest_comment))
+						resume_from = None
+						for comment in comments:
 							if datetime.utcfromtimestamp(comment.created_utc) > datetime.utcnow() - timedelta(minutes=1):
 								continue
-							if comment.author.name.lower() == "nfcaaofficialrefbot":
+							if comment.created_utc < newest_created:
+								# Already swept, only seen again when the latest page is checked
+								continue
+							if resume_from is None:
+								resume_from = comment
+							if processed.contains(comment.fullname):
+								continue
+							if comment.author is None or comment.author.name.lower() == "nfcaaofficialrefbot":
 								continue
-							recently_processed_comments.put(comment.id)
-							if comment.parent().author.name.lower() != "nfcaaofficialrefbot":
+							if not posted.contains(comment.parent_id):
 								continue
 							log.info(f"Handling missed comment: <https://www.reddit.com{comment.permalink}?context=9>")
-							handle_message(comment)
+							dispatch_message(comment)
 							count_messages += 1
 
+						if not len(comments):
+							# Nothing new, or the comment we resume from was removed and the listing can't find it. Check the
+							# latest page next time, comments older than the newest one seen are skipped
+							newest_comment = None
+						elif resume_from is not None:
+							newest_comment = resume_from.fullname
+							newest_created = resume_from.created_utc
 						comments_checked = datetime.utcnow()
 				except Exception as e:
 					log.warning(f"Exception checking subreddit comments: {e}")
+					newest_comment = None
 
 				if count_messages % 50 == 0:
 					wiki.updateCoachesWiki()
 					wiki.updateGamesWiki()
+				utils.publishGameThreads()
+				wiki.publishWikiPages()
+				reddit.processWrites()
 
 				discord_logging.flush_discord()
 
 				if once:
+					game_dispatcher.wait()
 					break
 
 		except Exception as err:
@@ -244,6 +378,8 @@ if __name__ == "__main__":
 		discord_logging.flush_discord()
 
 		if once:
+			index.flushGames()
+			save_snapshot()
 			break
 
 		time.sleep(5 * 60)
@@ -16,6 +16,7 @@ import index
 import string_utils
 import file_utils
 import coach_stats
+from fullname_store import datatables
 from classes import Play, Action, TimeoutOption, TimeOption, T, HomeAway
 
 log = logging.getLogger("bot")
@@ -372,19 +373,19 @@ def processMessageKickGame(body):
 		return "Couldn't find a thread id in message"
 	log.debug("Found thread id: {}".format(threadIds[0]))
 
-	game = index.reloadAndReturn(threadIds[0], alwaysReturn=True)
+	game = index.getGame(threadIds[0], alwaysReturn=True)
 	if game is None:
 		return "Game not found: {}".format(threadIds[0])
 
 	index.clearGameErrored(game)
-	file_utils.saveGameObject(game)
+	index.saveGame(game)
 	result = ["Kicked game: {}".format(threadIds[0])]
 
 	statusIndex = re.findall('(?:revert:)(\d+)', body)
 	if len(statusIndex) > 0:
 		log.debug("Reverting to status: {}".format(statusIndex[0]))
 		utils.revertStatus(game, int(statusIndex[0]))
-		file_utils.saveGameObject(game)
+		index.saveGame(game)
 		result.append("Reverted to status: {}".format(statusIndex[0]))
 
 	messageFullname = re.findall('(?:message:)(t\d_[\da-z]{6,8})', body)
@@ -409,9 +410,9 @@ def processMessagePauseGame(body):
 		return "Couldn't find a number of hours in message"
 	log.debug("Found hours: {}".format(hours[0]))
 
-	game = index.reloadAndReturn(threadIds[0])
+	game = index.getGame(threadIds[0])
 	utils.pauseGame(game, int(hours[0]))
-	file_utils.saveGameObject(game)
+	index.saveGame(game)
 
 	return "Game {} paused for {} hours".format(threadIds[0], hours[0])
 
@@ -424,7 +425,7 @@ def processMessageAbandonGame(body):
 		return "Couldn't find a thread id in message"
 	log.debug("Found thread id: {}".format(threadIds[0]))
 
-	game = index.reloadAndReturn(threadIds[0], True)
+	game = index.getGame(threadIds[0], True)
 	if game is None:
 		return "Game not found: {}".format(threadIds[0])
 
@@ -442,7 +443,7 @@ def processMessageAbandonGame(body):
 
 	utils.endGame(game, "Abandoned", False)
 	utils.updateGameThread(game)
-	file_utils.saveGameObject(game)
+	index.saveGame(game)
 	index.endGame(game)
 
 	return "Game {} abandoned".format(threadIds[0])
@@ -456,7 +457,7 @@ def processMessageNotification(body, subject):
 		return "Couldn't find a thread id in message"
 	log.debug("Found thread id: {}".format(threadIds[0]))
 
-	game = index.reloadAndReturn(threadIds[0], True)
+	game = index.getGame(threadIds[0], True)
 	if game is None:
 		return "Game not found: {}".format(threadIds[0])
 
@@ -472,7 +473,7 @@ def processMessageNotifyAll(body):
 	log.debug("Processing notify all games message")
 
 	countNotified = 0
-	for game in index.games.values():
+	for game in index.getGamesSnapshot().values():
 		log.debug("Notifying game: {}".format(game.thread))
 		reddit.replySubmission(
 			game.thread,
@@ -491,7 +492,7 @@ def processMessageGameStatus(body):
 		return "Couldn't find a thread id in message"
 	log.debug("Found thread id: {}".format(threadIds[0]))
 
-	game = index.reloadAndReturn(threadIds[0])
+	game = index.getGame(threadIds[0])
 	if game is None:
 		return "Game {} doesn't exist".format(threadIds[0])
 	else:
@@ -513,7 +514,7 @@ def processMessageDefaultChew(body):
 		return "Couldn't find a thread id in message"
 	log.debug("Found thread id: {}".format(threadIds[0]))
 
-	game = index.reloadAndReturn(threadIds[0])
+	game = index.getGame(threadIds[0])
 	if game is None:
 		return "Game not found: {}".format(threadIds[0])
 
@@ -525,7 +526,7 @@ def processMessageDefaultChew(body):
 		result = "Game changed to chew the clock plays by default: {}".format(threadIds[0])
 
 	utils.updateGameThread(game)
-	file_utils.saveGameObject(game)
+	index.saveGame(game)
 
 	return result
 
@@ -564,7 +565,7 @@ def processMessageTeams(body, subject):
 					if len(game.previousStatus):
 						log.debug("Reverting status and reprocessing {}".format(game.previousStatus[0].messageId))
 						utils.revertStatus(game, 0)
-						file_utils.saveGameObject(game)
+						index.saveGame(game)
 						reprocessPlay(game, game.status.messageId, True)
 						bldr.append(" and reprocessed last play")
 					else:
@@ -598,7 +599,7 @@ def processMessageRestartGame(body):
 	threadId = threadIdGroup.group(1)
 	log.debug("Found thread id: {}".format(threadId))
 
-	game = index.reloadAndReturn(threadId)
+	game = index.getGame(threadId)
 	if game is None:
 		log.info(f"Couldn't load game {threadId}")
 		return "Game not found: {}".format(threadId)
@@ -608,7 +609,7 @@ def processMessageRestartGame(body):
 	log.debug("Abandoning game")
 	utils.endGame(game, "Abandoned", False)
 	utils.updateGameThread(game)
-	file_utils.saveGameObject(game)
+	index.saveGame(game)
 	index.endGame(game)
 
 	bldr.append(utils.startGame(
@@ -634,7 +635,7 @@ def processMessageRerunLastPlay(body):
 	threadId = threadIdGroup.group(1)
 	log.debug("Found thread id: {}".format(threadId))
 
-	game = index.reloadAndReturn(threadId)
+	game = index.getGame(threadId)
 	if game is None:
 		log.info(f"Couldn't load game {threadId}")
 		return f"Game not found: {threadId}"
@@ -649,7 +650,7 @@ def processMessageRerunLastPlay(body):
 		if len(game.previousStatus):
 			log.debug("Reverting status and reprocessing {}".format(game.previousStatus[0].messageId))
 			utils.revertStatus(game, 0)
-			file_utils.saveGameObject(game)
+			index.saveGame(game)
 			reprocessPlay(game, game.status.messageId, True)
 			if game.errored:
 				log.warning(f"Game still errored after rerun: {game.thread}")
@@ -666,7 +667,48 @@ def processMessageRerunLastPlay(body):
 	return f"Reran last play for game {threadId}"
 
 
+def getMessageDataTable(message, isRerun=False):
+	isMessage = isinstance(message, praw.models.Message)
+	dataTable = None
+	message_created = datetime.utcfromtimestamp(message.created_utc)
+	if message.parent_id is not None and (message.parent_id.startswith("t1") or message.parent_id.startswith("t4")):
+		parentCreated = None
+		cached = datatables.get(message.parent_id)
+		if cached is not None:
+			counters.datatable_cache.labels(type="hit").inc()
+			tableText, parentCreated = cached
+			dataTable = string_utils.extractTableFromMessage(tableText)
+		else:
+			counters.datatable_cache.labels(type="miss").inc()
+			if isMessage:
+				parent = reddit.getMessage(message.parent_id[3:])
+			else:
+				parent = reddit.getComment(message.parent_id[3:])
+
+			if parent is not None and str(parent.author).lower() == static.ACCOUNT_NAME:
+				dataTable = string_utils.extractTableFromMessage(parent.body)
+				parentCreated = parent.created_utc
+
+		if dataTable is not None:
+			if 'action' not in dataTable or 'thread' not in dataTable:
+				dataTable = None
+			else:
+				dataTable['source'] = message.parent_id
+				log.debug("Found a valid datatable in parent message: {}".format(str(dataTable)))
+
+		if parentCreated is not None and not isRerun:
+			seconds_lag = (message_created - datetime.utcfromtimestamp(parentCreated)).total_seconds()
+			log.debug(f"Saving reply lag of {seconds_lag:.0f} for u/{message.author.name}")
+			coach_stats.add_stat(message.author.name, seconds_lag)
+
+	return dataTable
+
+
 def processMessage(message, reprocess=False, isRerun=False):
+	return processParsedMessage(message, getMessageDataTable(message, isRerun), reprocess, isRerun)
+
+
+def processParsedMessage(message, dataTable, reprocess=False, isRerun=False):
 	if isinstance(message, praw.models.Message):
 		isMessage = True
 		log.debug("Processing a message from /u/{} : {}".format(str(message.author), message.id))
@@ -677,40 +719,18 @@ def processMessage(message, reprocess=False, isRerun=False):
 	response = None
 	success = None
 	updateWaiting = True
-	dataTable = None
 
-	message_created = datetime.utcfromtimestamp(message.created_utc)
 	if not isRerun:
-		counters.reply_latency.observe((datetime.utcnow() - message_created).total_seconds())
-
-	if message.parent_id is not None and (message.parent_id.startswith("t1") or message.parent_id.startswith("t4")):
-		if isMessage:
-			parent = reddit.getMessage(message.parent_id[3:])
-		else:
-			parent = reddit.getComment(message.parent_id[3:])
-
-		if parent is not None and str(parent.author).lower() == static.ACCOUNT_NAME:
-			dataTable = string_utils.extractTableFromMessage(parent.body)
-			if dataTable is not None:
-				if 'action' not in dataTable or 'thread' not in dataTable:
-					dataTable = None
-				else:
-					dataTable['source'] = parent.fullname
-					log.debug("Found a valid datatable in parent message: {}".format(str(dataTable)))
-
-			if not isRerun:
-				seconds_lag = (message_created - datetime.utcfromtimestamp(parent.created_utc)).total_seconds()
-				log.debug(f"Saving reply lag of {seconds_lag:.0f} for u/{message.author.name}")
-				coach_stats.add_stat(message.author.name, seconds_lag)
+		counters.reply_latency.observe(
+			(datetime.utcnow() - datetime.utcfromtimestamp(message.created_utc)).total_seconds())
 
 	body = message.body.lower()
 	author = str(message.author)
 	game = None
 	appendMessageId = False
 	if dataTable is not None:
-		game = index.reloadAndReturn(dataTable['thread'])
+		game = index.getGame(dataTable['thread'])
 		if game is not None:
-			utils.cycleStatus(game, message.fullname, not reprocess)
 			utils.setLogGameID(game.thread, game)
 
 			waitingOn = utils.isGameWaitingOn(game, author, dataTable['action'], dataTable['source'], reprocess)
@@ -726,6 +746,8 @@ def processMessage(message, reprocess=False, isRerun=False):
 				updateWaiting = False
 
 			else:
+				# Only cycle once the message is going to be processed, rejected messages leave the game untouched
+				utils.cycleStatus(game, message.fullname, not reprocess)
 				game.playRerun = isRerun
 				if dataTable['action'] == Action.COIN and not isMessage:
 					keywords = ["heads", "tails"]
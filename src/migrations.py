@@ -0,0 +1,69 @@
+import logging.handlers
+
+import classes
+
+log = logging.getLogger("bot")
+
+# Each migration upgrades an object from the version it's registered under to the next one. Objects saved before
+# versioning have no schemaVersion and start at 0
+gameMigrations = {}
+teamMigrations = {}
+
+
+def gameMigration(version):
+	def register(func):
+		gameMigrations[version] = func
+		return func
+	return register
+
+
+def teamMigration(version):
+	def register(func):
+		teamMigrations[version] = func
+		return func
+	return register
+
+
+@teamMigration(0)
+def teamDefaults(team):
+	if team.conference == "":
+		team.conference = None
+	if not hasattr(team, "css_tag"):
+		team.css_tag = None
+
+
+@gameMigration(0)
+def gameDefaults(game):
+	if not hasattr(game, "gistUpdatePending"):
+		game.gistUpdatePending = False
+	for status in [game.status] + game.previousStatus:
+		if not hasattr(status, "timeoutMessages"):
+			status.timeoutMessages = []
+		if not hasattr(status, "winner"):
+			status.winner = None
+	for team in [game.home, game.away]:
+		migrateTeam(team)
+
+
+def migrate(thing, migrations, currentVersion):
+	version = getattr(thing, "schemaVersion", 0)
+	if version == currentVersion:
+		return False
+	if version > currentVersion:
+		raise ValueError(f"Schema version {version} is newer than this bot supports: {currentVersion}")
+	while version < currentVersion:
+		migrations[version](thing)
+		version += 1
+	thing.schemaVersion = version
+	return True
+
+
+def migrateGame(game):
+	changed = migrate(game, gameMigrations, classes.GAME_SCHEMA_VERSION)
+	if changed:
+		log.info(f"Migrated game {game.thread} to schema version {game.schemaVersion}")
+	return changed
+
+
+def migrateTeam(team):
+	return migrate(team, teamMigrations, classes.TEAM_SCHEMA_VERSION)
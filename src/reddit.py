@@ -1,20 +1,42 @@
 import logging.handlers
 import praw
 import configparser
+import threading
+import time
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import static
+import counters
+from classes import WritePriority
+from fullname_store import posted, datatables
 
 log = logging.getLogger("bot")
 reddit = None
 noWrite = False
+submissions = {}
+MAX_CACHED_SUBMISSIONS = 1000
+# Writes that can wait, keyed by what they write to so a newer write to the same target replaces the older one
+pendingWrites = {}
+writesLock = threading.Lock()
+message_pool = ThreadPoolExecutor(max_workers=static.MESSAGE_SEND_WORKERS, thread_name_prefix="message")
+requestLock = threading.RLock()
+
+
+class LockedReddit(praw.Reddit):
+	# praw isn't thread safe, every api call goes through request so holding one lock there covers lazy loads,
+	# listings, streams and token refreshes from any thread
+	def request(self, *args, **kwargs):
+		with requestLock:
+			return super().request(*args, **kwargs)
 
 
 def init(user):
 	global reddit
 
 	try:
-		reddit = praw.Reddit(
+		reddit = LockedReddit(
 			user,
 			user_agent=static.USER_AGENT)
 	except configparser.NoSectionError:
@@ -47,6 +69,76 @@ def init(user):
 	return True
 
 
+def getRemainingRequests():
+	limits = reddit.auth.limits
+	remaining = limits.get('remaining')
+	if remaining is not None:
+		counters.reddit_ratelimit.set(remaining)
+	resetTimestamp = limits.get('reset_timestamp')
+	if resetTimestamp is not None and resetTimestamp < time.time():
+		return None
+	return remaining
+
+
+def hasWriteBudget(priority):
+	reserve = static.REDDIT_WRITE_RESERVE.get(priority.name, 0)
+	if reserve <= 0:
+		return True
+	remaining = getRemainingRequests()
+	return remaining is None or remaining > reserve
+
+
+def countWrite(priority, queuedTime=None):
+	counters.reddit_writes.labels(priority=priority.name).inc()
+	if queuedTime is not None:
+		counters.reddit_write_wait.labels(priority=priority.name).observe(time.time() - queuedTime)
+
+
+def updateWriteQueueGauge():
+	depths = {priority: 0 for priority in WritePriority}
+	for priority, queuedTime, func, args in pendingWrites.values():
+		depths[priority] += 1
+	for priority, depth in depths.items():
+		counters.reddit_write_queue.labels(priority=priority.name).set(depth)
+
+
+def queueWrite(priority, key, func, *args):
+	with writesLock:
+		queued = pendingWrites.get(key)
+		queuedTime = queued[1] if queued is not None else time.time()
+		pendingWrites[key] = (priority, queuedTime, func, args)
+		updateWriteQueueGauge()
+
+
+def cancelWrite(key):
+	with writesLock:
+		queued = pendingWrites.pop(key, None)
+		updateWriteQueueGauge()
+		return queued
+
+
+def processWrites(force=False):
+	while True:
+		with writesLock:
+			if not len(pendingWrites):
+				return
+			key = min(pendingWrites, key=lambda pendingKey: (pendingWrites[pendingKey][0].value, pendingWrites[pendingKey][1]))
+			priority, queuedTime, func, args = pendingWrites[key]
+			if not force and not hasWriteBudget(priority):
+				# Everything left is this priority or lower, so it all waits for the ratelimit to recover
+				log.debug(f"Low on reddit requests, holding {len(pendingWrites)} writes")
+				return
+			del pendingWrites[key]
+			updateWriteQueueGauge()
+
+		try:
+			func(*args)
+		except Exception as err:
+			log.warning(f"Error sending queued write {key}: {err}")
+			log.warning(traceback.format_exc())
+		countWrite(priority, queuedTime)
+
+
 def getMessages():
 	return reddit.inbox.unread(limit=100)
 
@@ -58,17 +150,90 @@ def getMessage(id):
 		return None
 
 
-def sendMessage(recipients, subject, message):
+def tagMessage(message, token):
+	tag = "{}{})".format(static.messagetag, token)
+	datatagLocation = message.find(static.datatag)
+	if datatagLocation == -1:
+		return message + tag
+	else:
+		return message[:datatagLocation] + tag + message[datatagLocation:]
+
+
+def recordDataTable(fullname, body):
+	try:
+		datatagLocation = body.find(static.datatag)
+		if datatagLocation != -1:
+			datatables.add(fullname, body[datatagLocation:], time.time())
+	except Exception as err:
+		log.warning(f"Error saving datatable for {fullname}: {err}")
+
+
+def recordPosted(fullname):
+	try:
+		posted.add(fullname)
+	except Exception as err:
+		log.warning(f"Error saving posted fullname {fullname}: {err}")
+
+
+def sendTaggedMessage(recipient, subject, message):
+	reddit.redditor(recipient).message(
+		subject=subject,
+		message=message
+	)
+	countWrite(WritePriority.REPLY)
+
+
+def findSentMessages(tokens):
+	found = {}
+	for retrySeconds in [0] + static.SENT_MESSAGE_SEARCH_RETRY_SECONDS:
+		if retrySeconds:
+			time.sleep(retrySeconds)
+		for message in reddit.inbox.sent(limit=static.SENT_MESSAGE_SEARCH_LIMIT):
+			for token in tokens:
+				if token not in found and "{}{})".format(static.messagetag, token) in message.body:
+					found[token] = message
+		if len(found) == len(tokens):
+			break
+	return found
+
+
+def sendMessage(recipients, subject, message, findSent=True):
 	if not isinstance(recipients, list):
 		recipients = [recipients]
-	results = []
-	for recipient in recipients:
-			reddit.redditor(recipient).message(
-				subject=subject,
-				message=message
-			)
-			results.append(getRecentSentMessage())
+	if not len(recipients):
+		return []
+	tokens = [uuid.uuid4().hex[:16] for recipient in recipients]
+	futures = [
+		message_pool.submit(sendTaggedMessage, recipient, subject, tagMessage(message, token))
+		for recipient, token in zip(recipients, tokens)
+	]
+	sentTokens = []
+	error = None
+	for recipient, token, future in zip(recipients, tokens, futures):
+		try:
+			future.result()
+			sentTokens.append(token)
+		except Exception as err:
+			log.warning(f"Error sending message to {recipient}: {err}")
+			error = err
 
+	results = []
+	if not len(sentTokens) and error is not None:
+		raise error
+	if not findSent:
+		return results
+
+	found = findSentMessages(sentTokens)
+	missing = []
+	for recipient, token in zip(recipients, tokens):
+		if token in found:
+			results.append(found[token])
+			recordDataTable(found[token].fullname, message)
+		elif token in sentTokens:
+			missing.append(recipient)
+	if len(missing):
+		# Callers wait on the returned ids, a message we can't find would leave the game waiting on nothing
+		raise ValueError(f"Couldn't find messages sent to {', '.join(missing)} in the sent box")
 	return results
 
 
@@ -76,6 +241,9 @@ def replySubmission(id, message):
 	try:
 		submission = getSubmission(id)
 		resultComment = submission.reply(message)
+		countWrite(WritePriority.REPLY)
+		recordDataTable(resultComment.fullname, message)
+		recordPosted(resultComment.fullname)
 		return resultComment
 	except Exception as err:
 		log.warning(traceback.format_exc())
@@ -96,11 +264,20 @@ def setWikiPage(subreddit, pageName, content):
 
 
 def submitSelfPost(subreddit, title, text):
-	return reddit.subreddit(subreddit).submit(title=title, selftext=text)
+	submission = reddit.subreddit(subreddit).submit(title=title, selftext=text)
+	countWrite(WritePriority.REPLY)
+	recordPosted(submission.fullname)
+	return submission
 
 
 def getSubmission(id):
-	return reddit.submission(id=id)
+	submission = submissions.get(id)
+	if submission is None:
+		submission = reddit.submission(id=id)
+		if len(submissions) >= MAX_CACHED_SUBMISSIONS:
+			del submissions[next(iter(submissions))]
+		submissions[id] = submission
+	return submission
 
 
 def editThread(id, text):
@@ -112,17 +289,25 @@ def getComment(id):
 	return reddit.comment(id)
 
 
-def getMessageStream():
-	return reddit.inbox.stream()
+def getMessageStream(pause_after=None):
+	return reddit.inbox.stream(pause_after=pause_after)
 
 
-def getSubredditComments(subreddit, limit=100):
-	return reddit.subreddit(subreddit).comments(limit=limit)
+def getSubredditComments(subreddit, limit=100, before=None):
+	if before is None:
+		return reddit.subreddit(subreddit).comments(limit=limit)
+	else:
+		return reddit.subreddit(subreddit).comments(limit=limit, params={'before': before})
 
 
 def replyMessage(message, body):
 	try:
-		return message.reply(body)
+		result = message.reply(body)
+		countWrite(WritePriority.REPLY)
+		if result is not None:
+			recordDataTable(result.fullname, body)
+			recordPosted(result.fullname)
+		return result
 	except praw.exceptions.RedditAPIException as err:
 		if err.error_type == 'DELETED_COMMENT':
 			log.info(f"Unable to reply, comment deleted: {message.id}")
@@ -136,10 +321,6 @@ def replyMessage(message, body):
 		return None
 
 
-def getRecentSentMessage():
-	return next(reddit.inbox.sent(limit=1))
-
-
 def getThingFromFullname(fullname):
 	if fullname.startswith("t1"):
 		return getComment(fullname[3:])
@@ -22,7 +22,7 @@ LOG_FILE_MAXSIZE = 1024 * 256 * 64
 
 class ContextFilter(logging.Filter):
 	def filter(self, record):
-		record.gameid = static.logGameId
+		record.gameid = static.logGameId.get()
 		return True
 
 log = logging.getLogger("bot")
@@ -38,18 +38,6 @@ if LOG_FILENAME is not None:
 	log.addHandler(log_fileHandler)
 
 
-def addWinnerFieldToGames():
-	folder = static.SAVE_FOLDER_NAME
-	for fileName in os.listdir(folder):
-		if not os.path.isfile(os.path.join(folder, fileName)):
-			continue
-		game = file_utils.loadGameObject(fileName)
-		game.status.winner = None
-		for status in game.previousStatus:
-			status.winner = None
-			file_utils.saveGameObject(game)
-
-
 def archiveOutstandingFinishedGames():
 	folder = static.SAVE_FOLDER_NAME
 	for fileName in os.listdir(folder):
@@ -98,6 +86,14 @@ def pastebinPlaylist(game_id, config_section):
 	log.info(static.GIST_BASE_URL + config_section['gist_username'] + "/" + gistId)
 
 
+def migrateGames():
+	# Loading a game from the save folder upgrades and rewrites it
+	for gameFile in os.listdir(static.SAVE_FOLDER_NAME):
+		game = file_utils.loadGameObject(gameFile)
+		if game is None:
+			log.warning("Can't migrate game: {}".format(gameFile))
+
+
 def archiveEndedGames():
 	for gameFile in os.listdir(static.SAVE_FOLDER_NAME):
 		try:
@@ -141,5 +137,7 @@ elif functionName == "pastebinPlaylist":
 	pastebinPlaylist("test", config['Watchful1BotTest'])
 elif functionName == "archiveEndedGames":
 	archiveEndedGames()
+elif functionName == "migrateGames":
+	migrateGames()
 elif functionName == "testStrings":
 	loadPrintStrings()
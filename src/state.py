@@ -171,8 +171,8 @@ def findNumberInRangeDict(number, dict):
 
 
 def getPlayResult(game, play, number):
-	playDict = wiki.getPlay(play)
-	if playDict is None:
+	playTable = wiki.getPlayTable(play)
+	if playTable is None:
 		log.warning(f"{play} is not a valid play")
 		return None
 
@@ -181,12 +181,18 @@ def getPlayResult(game, play, number):
 		offense = game.status.playbook(game.status.possession).offense
 		defense = game.status.playbook(game.status.possession.negate()).defense
 		log.debug("Movement play offense, defense: {} : {}".format(offense, defense))
-		playMajorRange = playDict[offense][defense]
+		locationTable = playTable[offense][defense]
 	else:
-		playMajorRange = playDict
+		locationTable = playTable
 
-	playMinorRange = findNumberInRangeDict(100 - game.status.location, playMajorRange)
-	result = findNumberInRangeDict(number, playMinorRange)
+	numberTable = locationTable.find(100 - game.status.location)
+	if numberTable is None:
+		log.warning(f"Could not find location {100 - game.status.location} in play table")
+		return None
+	result = numberTable.find(number)
+	if result is None:
+		log.warning(f"Could not find number {number} in play table")
+		return None
 	log.debug(f"Result: {result['result']} : {result['yards'] if 'yards' in result else 'no yards'}")
 	return result
 
@@ -209,6 +215,15 @@ def getTimeAfterForOffense(game, homeAway):
 
 
 def getTimeByPlay(play, result, yards):
+	if result in [Result.GAIN, Result.KICK]:
+		time = wiki.getTimeByYards(play, result, yards)
+		if time is None:
+			log.warning("Could not get time table for play: {} : {}".format(play, result))
+			return None
+
+		log.debug("Found a valid time object in gain, returning: {}".format(time))
+		return time
+
 	timePlay = wiki.getTimeByPlay(play)
 	if timePlay is None:
 		log.warning("Could not get time result for play: {}".format(play))
@@ -219,25 +234,8 @@ def getTimeByPlay(play, result, yards):
 		return None
 
 	timeObject = timePlay[result]
-	if result in [Result.GAIN, Result.KICK]:
-		closestObject = None
-		currentDifference = 100
-		for yardObject in timeObject:
-			difference = abs(yardObject['yards'] - yards)
-			if difference < currentDifference:
-				currentDifference = difference
-				closestObject = yardObject
-
-		if closestObject is None:
-			log.warning("Could not get any yardObject")
-			return None
-
-		log.debug("Found a valid time object in gain, returning: {}".format(closestObject['time']))
-		return closestObject['time']
-
-	else:
-		log.debug("Found a valid time object in {}, returning: {}".format(result, timeObject['time']))
-		return timeObject['time']
+	log.debug("Found a valid time object in {}, returning: {}".format(result, timeObject['time']))
+	return timeObject['time']
 
 
 def checkQuarterStatus(game, timeOffClock):
@@ -1,18 +1,48 @@
+import contextvars
 from pytz import timezone
 
 ### Config ###
 LOG_FOLDER_NAME = "logs"
 SAVE_FOLDER_NAME = "games"
 ARCHIVE_FOLDER_NAME = "gamesOld"
+BROKEN_FOLDER_NAME = "gamesBroken"
 STRING_SUGGESTION_FILE = "suggestions.txt"
 RESTART_REASON_FILE = "restarts.txt"
 TEAMS_FILE = "teams.pickle"
+UPLOAD_CACHE_FILE = "uploads.txt"
+SNAPSHOT_FILE = "games.snapshot"
 SUBREDDIT = "FakeCollegeFootball"
 CONFIG_SUBREDDIT = "FakeCollegeFootball"
 USER_AGENT = "FakeCFBRef (by /u/Watchful1)"
 OWNER = "watchful1"
 LOOP_TIME = 2*60
 DATABASE_NAME = "database.db"
+# How many of the bot's own datatables to keep locally, so replies don't need to fetch their parent
+DATATABLE_CACHE_SIZE = 20000
+# How many handled message and comment fullnames to remember, so nothing is processed twice across restarts
+PROCESSED_CACHE_SIZE = 5000
+# How many of the bot's own comment and post fullnames to remember, so the missed comment sweep can tell replies to the bot apart
+POSTED_CACHE_SIZE = 20000
+# "files" keeps games in the games and gamesOld folders, "sqlite" keeps them in GAME_DATABASE_NAME
+GAME_STORE = "files"
+GAME_DATABASE_NAME = "games.db"
+JOURNAL_COMPACT_RECORDS = 50
+# When to fsync game files: "always", "compact" (only full rewrites) or "never"
+FSYNC_POLICY = "always"
+WIKI_UPDATE_WINDOW = 60
+THREAD_EDIT_WINDOW = 20
+THREAD_EDIT_RETRIES = 5
+# Games processed at once. Reddit requests from every lane are serialized by reddit.requestLock
+MESSAGE_WORKERS = 4
+# Queued reddit writes of a priority are held back while fewer than this many requests are left in the ratelimit window
+REDDIT_WRITE_RESERVE = {"THREAD_EDIT": 30, "WIKI": 100}
+MESSAGE_SEND_WORKERS = 4
+SENT_MESSAGE_SEARCH_LIMIT = 100
+SENT_MESSAGE_SEARCH_RETRY_SECONDS = [1, 5]
+LOAD_WORKERS = 4
+SNAPSHOT_ON_SHUTDOWN = True
+# Compare the in memory game to the saved file every time it's used, for debugging
+CHECK_GAME_CACHE = False
 SUBREDDIT_LINK = "https://www.reddit.com/r/{}/comments/".format(SUBREDDIT)
 MESSAGE_LINK = "https://www.reddit.com/message/messages/"
 ACCOUNT_NAME = "default"
@@ -46,14 +76,19 @@ def get_webhook_for_conference(division):
 ### Images ###
 field_height = 212
 field_width = 480
+DRIVE_IMAGE_FORMAT = "palette"  # "rgb", "palette" or "svg"
+DRIVE_UPLOAD_WORKERS = 2
+DRIVE_UPLOAD_RETRY_SECONDS = [10, 60, 300]
 
 
 ### Constants ###
 datatag = " [](#datatag"
+messagetag = " [](#messagetag"
 
 ### Log ###
-logGameId = ""
-game = None
+# Set per message, so each worker thread logs and errors the game it's working on
+logGameId = contextvars.ContextVar('logGameId', default="")
+game = contextvars.ContextVar('game', default=None)
 
 
 ## Lengths ##
@@ -2,7 +2,10 @@ import logging.handlers
 import random
 import re
 import time
-import copy
+import hashlib
+import threading
+import uuid
+import traceback
 import requests
 import json
 import prawcore
@@ -15,13 +18,22 @@ import reddit
 import classes
 import index
 import string_utils
-import file_utils
 import drive_graphic
 import counters
-from classes import HomeAway, Action, Play, Result, QuarterType, DriveSummary, PlayclockWarning
+from classes import HomeAway, Action, Play, Result, QuarterType, DriveSummary, PlayclockWarning, WritePriority
 
 log = logging.getLogger("bot")
 
+threadHashes = {}
+pendingThreadEdits = {}
+pendingEditsLock = threading.Lock()
+# Held while a game thread is edited, so the final edit when a game ends can't be overtaken by an older queued one
+threadEditLock = threading.Lock()
+# Threads of ended games, queued edits to these are dropped
+closedThreads = set()
+# Failed edits in a row per thread, the edit is dropped after static.THREAD_EDIT_RETRIES
+threadEditFailures = {}
+
 
 def error_is_transient(exception):
 	return isinstance(exception, prawcore.exceptions.ServerError) or \
@@ -227,17 +239,87 @@ def updateGameThread(game):
 	if game.thread is None:
 		log.error("No thread ID in game when trying to update")
 	game.dirty = False
-	file_utils.saveGameObject(game)
+	index.saveGame(game)
 	threadText = string_utils.renderGame(game)
+	with pendingEditsLock:
+		requested, previousText = pendingThreadEdits.get(game.thread, (datetime.utcnow(), None))
+		pendingThreadEdits[game.thread] = (requested, threadText)
+	closedThreads.discard(game.thread)
+
+
+def editGameThread(thread, threadText):
+	threadHash = hashlib.sha256(threadText.encode('utf-8')).hexdigest()
+	if threadHashes.get(thread) == threadHash:
+		log.debug(f"Thread {thread} unchanged, skipping edit")
+		return False
+
 	try:
-		reddit.editThread(game.thread, threadText)
+		reddit.editThread(thread, threadText)
 	except Exception as err:
 		if error_is_transient(err):
 			log.info("Transient error editing thread, waiting and trying again")
 			time.sleep(10)
-			reddit.editThread(game.thread, threadText)
+			reddit.editThread(thread, threadText)
 		else:
 			raise
+	threadHashes[thread] = threadHash
+	return True
+
+
+def publishQueuedGameThread(thread, requested, threadText):
+	with threadEditLock:
+		if thread in closedThreads:
+			log.debug(f"Game thread {thread} already closed, dropping queued edit")
+			return
+		try:
+			editGameThread(thread, threadText)
+			threadEditFailures.pop(thread, None)
+		except Exception as err:
+			log.warning(f"Couldn't edit game thread {thread}: {err}")
+			log.warning(traceback.format_exc())
+			failures = threadEditFailures.get(thread, 0) + 1
+			if not error_is_transient(err) or failures >= static.THREAD_EDIT_RETRIES:
+				log.warning(f"Dropping edit to game thread {thread} after {failures} tries")
+				threadEditFailures.pop(thread, None)
+			else:
+				threadEditFailures[thread] = failures
+				with pendingEditsLock:
+					pendingThreadEdits.setdefault(thread, (requested, threadText))
+
+
+def publishGameThreads(force=False):
+	due = []
+	with pendingEditsLock:
+		for thread, (requested, threadText) in list(pendingThreadEdits.items()):
+			if not force and requested + timedelta(seconds=static.THREAD_EDIT_WINDOW) > datetime.utcnow():
+				continue
+			due.append((thread, pendingThreadEdits.pop(thread)))
+	for thread, (requested, threadText) in due:
+		reddit.queueWrite(
+			WritePriority.THREAD_EDIT, ("thread", thread), publishQueuedGameThread, thread, requested, threadText)
+	if force:
+		reddit.processWrites(force=True)
+
+
+def flushGameThread(thread):
+	with threadEditLock:
+		queued = reddit.cancelWrite(("thread", thread))
+		threadText = None
+		with pendingEditsLock:
+			pending = pendingThreadEdits.pop(thread, None)
+		if pending is not None:
+			requested, threadText = pending
+		elif queued is not None:
+			priority, queuedTime, func, (queuedThread, requested, threadText) = queued
+		if threadText is not None:
+			try:
+				editGameThread(thread, threadText)
+			except Exception as err:
+				log.warning(f"Couldn't edit game thread {thread}: {err}")
+				log.warning(traceback.format_exc())
+		closedThreads.add(thread)
+		threadHashes.pop(thread, None)
+		threadEditFailures.pop(thread, None)
 
 
 def coachHomeAway(game, coach, checkPast=False):
@@ -256,10 +338,12 @@ def coachHomeAway(game, coach, checkPast=False):
 
 
 def sendGameMessage(isHome, game, message, dataTable):
-	reddit.sendMessage(game.team(isHome).coaches,
+	results = reddit.sendMessage(game.team(isHome).coaches,
 					   "{} vs {}".format(game.home.name, game.away.name),
 					   string_utils.embedTableInMessage(message, dataTable))
-	return reddit.getRecentSentMessage().id
+	if not len(results):
+		return None
+	return results[-1].id
 
 
 def sendGameComment(game, message, dataTable=None, saveWaiting=True):
@@ -373,13 +457,13 @@ def extractPlayNumber(message):
 
 
 def setLogGameID(threadId, game):
-	static.game = game
-	static.logGameId = " {}:".format(threadId)
+	static.game.set(game)
+	static.logGameId.set(" {}:".format(threadId))
 
 
 def clearLogGameID():
-	static.game = None
-	static.logGameId = ""
+	static.game.set(None)
+	static.logGameId.set("")
 
 
 def findKeywordInMessage(keywords, message):
@@ -430,7 +514,7 @@ def isGameOvertime(game):
 
 
 def cycleStatus(game, messageId, cyclePlaybooks=True):
-	oldStatus = copy.deepcopy(game.status)
+	oldStatus = game.status.copy()
 	oldStatus.messageId = messageId
 	game.previousStatus.insert(0, oldStatus)
 	if len(game.previousStatus) > 5:
@@ -442,7 +526,7 @@ def cycleStatus(game, messageId, cyclePlaybooks=True):
 
 
 def revertStatus(game, index):
-	game.status = game.previousStatus[index]
+	game.status = game.previousStatus[index].copy()
 
 
 def newGameObject(home, away, quarterLength, quarter):
@@ -496,11 +580,38 @@ def endGame(game, winner, postThread=True):
 def pauseGame(game, hours):
 	game.playclock = datetime.utcnow() + timedelta(hours=hours + 18)
 	game.deadline = game.deadline + timedelta(hours=hours + 18)
+	index.schedulePlayclock(game)
 
 
 def setGamePlayed(game):
 	game.playclock = datetime.utcnow() + timedelta(hours=18)
 	game.playclockWarning = PlayclockWarning.NONE
+	index.schedulePlayclock(game)
+
+
+def setDriveImage(thread, driveNum, token, url):
+	game = index.games.get(thread)
+	if game is None or driveNum >= len(game.status.drives):
+		log.info(f"Drive {driveNum} for game {thread} is gone, dropping image {url}")
+		return
+	drive = game.status.drives[driveNum]
+	if drive.get('pending') != token:
+		log.info(f"Drive {driveNum} for game {thread} was redrawn, dropping stale image {url}")
+		return
+
+	# Replace rather than edit the entry, previous statuses and the save journal share it
+	game.status.drives[driveNum] = {'summary': drive['summary'], 'url': url}
+	log.debug(f"Drive {driveNum} image uploaded for game {thread}: {url}")
+	updateGameThread(game)
+
+
+def requestMissingDriveImages(game):
+	for driveNum, drive in enumerate(game.status.drives):
+		if (drive.get('pending') or not drive['url']) and driveNum < len(game.status.plays) - 1:
+			# A new token each time, so an upload still running from before can't land on this drive
+			token = uuid.uuid4().hex
+			game.status.drives[driveNum] = {'summary': drive['summary'], 'url': drive['url'], 'pending': token}
+			drive_graphic.queueDriveImage(game.status.plays[driveNum], game.thread, driveNum, token)
 
 
 def addPlay(game, playSummary, forceDriveEndType):
@@ -540,10 +651,12 @@ def addPlay(game, playSummary, forceDriveEndType):
 		else:
 			summary.result = drive[-1].actualResult
 
-		field = drive_graphic.makeField(plays=drive)
-		driveImageUrl = drive_graphic.uploadField(field, game.thread, str(len(game.status.plays) - 2))
-		game.status.drives.append({'summary': summary, 'url': driveImageUrl})
-		return f"Drive: [{str(summary)}]({driveImageUrl})"
+		# The image is uploaded in the background, the thread links the drive to itself until it's done. The reply
+		# is never edited, so it gets the summary without a link
+		token = uuid.uuid4().hex
+		drive_graphic.queueDriveImage(drive, game.thread, len(game.status.drives), token)
+		game.status.drives.append({'summary': summary, 'url': string_utils.getLinkToThread(game.thread), 'pending': token})
+		return f"Drive: {str(summary)}"
 	else:
 		game.status.plays[-1].append(playSummary)
 		return None
@@ -1,6 +1,8 @@
 import logging.handlers
 import re
 import time
+import hashlib
+import traceback
 import random
 import csv
 from datetime import datetime
@@ -12,25 +14,45 @@ import static
 import string_utils
 import file_utils
 import coach_stats
+import counters
 import index
 from classes import OffenseType
 from classes import DefenseType
 from classes import Result
+from classes import WritePriority
 from classes import Team
 from classes import Play
+from classes import RangeTable
 
 log = logging.getLogger("bot")
 
 teams = {}
 coaches = {}
 plays = {}
+playTables = {}
 times = {}
+timeTables = {}
 admins = set()
 intro = "Welcome to /r/FakeCollegeFootball!"
 strings = {}
 
 lastTime = None
 
+wikiHashes = {}
+pendingWikiPages = {}
+
+# Time tables cover gains from -TIME_TABLE_YARDS to TIME_TABLE_YARDS, anything past that is clamped to the edge
+TIME_TABLE_YARDS = 100
+requiredTimeTables = [
+	(Play.RUN, Result.GAIN),
+	(Play.PASS, Result.GAIN),
+	(Play.PUNT, Result.GAIN),
+	(Play.FIELD_GOAL, Result.GAIN),
+	(Play.KICKOFF_NORMAL, Result.KICK),
+	(Play.KICKOFF_SQUIB, Result.KICK),
+	(Play.KICKOFF_ONSIDE, Result.KICK),
+]
+
 
 def loadPages(force=False):
 	global lastTime
@@ -184,20 +206,74 @@ def loadTeams():
 	teams = file_utils.loadTeams()
 
 
+def renderTeamsWiki():
+	return string_utils.renderTeamsWiki(teams)
+
+
+def renderCoachesWiki():
+	coach_stats.delete_old_stats()
+	return string_utils.renderCoachesWiki(coach_stats.getCoaches())
+
+
+def renderGamesWiki():
+	return string_utils.renderGamesWiki(index.getGamesSnapshot())
+
+
+wikiRenderers = {
+	"teams": renderTeamsWiki,
+	"coaches": renderCoachesWiki,
+	"games": renderGamesWiki,
+}
+
+
+def requestWikiUpdate(pageName):
+	if pageName not in pendingWikiPages:
+		pendingWikiPages[pageName] = datetime.utcnow()
+
+
 def updateTeamsWiki():
-	teamsWikiString = string_utils.renderTeamsWiki(teams)
-	reddit.setWikiPage(static.SUBREDDIT, "teams", teamsWikiString)
+	requestWikiUpdate("teams")
 
 
 def updateCoachesWiki():
-	coach_stats.delete_old_stats()
-	coachesWikiString = string_utils.renderCoachesWiki(coach_stats.getCoaches())
-	reddit.setWikiPage(static.SUBREDDIT, "coaches", coachesWikiString)
+	requestWikiUpdate("coaches")
 
 
 def updateGamesWiki():
-	gamesWikiString = string_utils.renderGamesWiki(index.games)
-	reddit.setWikiPage(static.SUBREDDIT, "games", gamesWikiString)
+	requestWikiUpdate("games")
+
+
+def publishWikiPage(pageName, content):
+	contentHash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+	if wikiHashes.get(pageName) == contentHash:
+		log.debug(f"Wiki page {pageName} unchanged, skipping edit")
+		counters.wiki_edits.labels(page=pageName, type="skipped").inc()
+		return False
+
+	reddit.setWikiPage(static.SUBREDDIT, pageName, content)
+	wikiHashes[pageName] = contentHash
+	counters.wiki_edits.labels(page=pageName, type="performed").inc()
+	return True
+
+
+def publishQueuedWikiPage(pageName, requested):
+	try:
+		# Rendered when the write goes out, so a page held back by the ratelimit is still current
+		publishWikiPage(pageName, wikiRenderers[pageName]())
+	except Exception as err:
+		pendingWikiPages.setdefault(pageName, requested)
+		log.warning(f"Couldn't update wiki page {pageName}: {err}")
+		log.warning(traceback.format_exc())
+
+
+def publishWikiPages(force=False):
+	for pageName, requested in list(pendingWikiPages.items()):
+		if not force and requested + timedelta(seconds=static.WIKI_UPDATE_WINDOW) > datetime.utcnow():
+			continue
+		del pendingWikiPages[pageName]
+		reddit.queueWrite(WritePriority.WIKI, ("wiki", pageName), publishQueuedWikiPage, pageName, requested)
+	if force:
+		reddit.processWrites(force=True)
 
 
 def initOffenseDefense(play, offense, defense, range):
@@ -313,10 +389,37 @@ def loadPlays():
 		else:
 			plays[playType][items[1]] = playParts
 
+	compilePlayTables()
+
+
+def compileRangeTable(rangeDict, compileValue=None):
+	table = RangeTable()
+	for range, value in rangeDict.items():
+		rangeStart, rangeEnd = range.split("-")
+		if compileValue is not None:
+			value = compileValue(value)
+		table.add(int(rangeStart), int(rangeEnd), value)
+	return table
+
+
+def compilePlayTables():
+	global playTables
+	tables = {}
+	for playType, playDict in plays.items():
+		if playType in [Play.RUN, Play.PASS]:
+			tables[playType] = {}
+			for offense, offenseDict in playDict.items():
+				tables[playType][offense] = {}
+				for defense, locationDict in offenseDict.items():
+					tables[playType][offense][defense] = compileRangeTable(locationDict, compileRangeTable)
+		else:
+			tables[playType] = compileRangeTable(playDict, compileRangeTable)
+	playTables = tables
+
 
 def loadTimes():
 	global times
-	times = {}
+	loadedTimes = {}
 	with open("data/times.csv", 'r') as timesFile:
 		timesPage = timesFile.readlines()
 
@@ -329,8 +432,8 @@ def loadTimes():
 			log.warning("Could not parse play: {}".format(timeLine))
 			continue
 
-		if playType not in times:
-			times[playType] = {}
+		if playType not in loadedTimes:
+			loadedTimes[playType] = {}
 
 		for item in items[1:]:
 			timePart = item.split("|")
@@ -348,17 +451,55 @@ def loadTimes():
 					log.warning("Could not validate time: {}".format(timePart[2]))
 					continue
 
-				if result not in times[playType]:
-					times[playType][result] = []
+				if result not in loadedTimes[playType]:
+					loadedTimes[playType][result] = []
 				timeObject = {'yards': int(timePart[1]), 'time': int(timePart[2])}
-				times[playType][result].append(timeObject)
+				loadedTimes[playType][result].append(timeObject)
 			else:
 				if not validateItem(timePart[1], "\d+"):
 					log.warning("Could not validate time: {}".format(timePart[1]))
 					continue
 
 				timeObject = {'time': int(timePart[1])}
-				times[playType][result] = timeObject
+				loadedTimes[playType][result] = timeObject
+
+	compileTimeTables(loadedTimes)
+	times = loadedTimes
+
+
+def compileTimeTable(timeObjects):
+	if not len(timeObjects):
+		return None
+	listedYards = [timeObject['yards'] for timeObject in timeObjects]
+	if min(listedYards) < -TIME_TABLE_YARDS or max(listedYards) > TIME_TABLE_YARDS:
+		return None
+	# Slots past the lowest or highest listed yardage take the time of that edge entry
+	table = []
+	for yards in range(-TIME_TABLE_YARDS, TIME_TABLE_YARDS + 1):
+		closestObject = None
+		for timeObject in timeObjects:
+			if closestObject is None or abs(timeObject['yards'] - yards) < abs(closestObject['yards'] - yards):
+				closestObject = timeObject
+		table.append(closestObject['time'])
+	return table
+
+
+def compileTimeTables(loadedTimes):
+	global timeTables
+	tables = {}
+	for playType, playTimes in loadedTimes.items():
+		for result in [Result.GAIN, Result.KICK]:
+			if result in playTimes:
+				table = compileTimeTable(playTimes[result])
+				if table is None:
+					raise ValueError(
+						f"Time table for {playType} : {result} is empty or lists yardage outside {-TIME_TABLE_YARDS} to {TIME_TABLE_YARDS}")
+				tables[(playType, result)] = table
+
+	for playType, result in requiredTimeTables:
+		if (playType, result) not in tables:
+			raise ValueError(f"Missing time table for {playType} : {result}")
+	timeTables = tables
 
 
 def getTeamByTag(tag):
@@ -376,6 +517,13 @@ def getPlay(play):
 		return None
 
 
+def getPlayTable(play):
+	if play in playTables:
+		return playTables[play]
+	else:
+		return None
+
+
 def getTimeByPlay(play):
 	if play in times:
 		return times[play]
@@ -383,6 +531,13 @@ def getTimeByPlay(play):
 		return None
 
 
+def getTimeByYards(play, result, yards):
+	if (play, result) not in timeTables:
+		return None
+	yards = min(max(yards, -TIME_TABLE_YARDS), TIME_TABLE_YARDS)
+	return timeTables[(play, result)][yards + TIME_TABLE_YARDS]
+
+
 def loadAdmins():
 	adminsPage = reddit.getWikiPage(static.CONFIG_SUBREDDIT, "admins")
 
@@ -399,7 +554,7 @@ def loadIntro():
 
 def loadStrings():
 	global strings
-	strings = defaultdict(list)
+	loadedStrings = defaultdict(list)
 	with open("data/strings.csv", 'r') as stringsFile:
 		csv_reader = csv.reader(stringsFile, delimiter=",")
 		next(csv_reader)  # skip the headers
@@ -417,7 +572,8 @@ def loadStrings():
 				else:
 					greater = False
 				yards = int(row[3][1:])
-			strings[row[0]].append({'value': row[1], 'probability': probability, 'yards': yards, 'yardsGreater': greater})
+			loadedStrings[row[0]].append({'value': row[1], 'probability': probability, 'yards': yards, 'yardsGreater': greater})
+	strings = loadedStrings
 
 
 def getStringFromKey(stringKey, yards=None, repl=None):